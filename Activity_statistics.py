@@ -0,0 +1,112 @@
+'''
+Streaming statistics of the activity of a spatial reservoir, per region of the plane.
+The regions are either vertical bins along x, or the cells of a 2D grid. The neurons are aggregated with a precomputed sparse matrix,
+so each step only costs one sparse product, and the statistics over time (mean, variance, min, max) are updated online (Welford's algorithm).
+'''
+import numpy as np
+import scipy.sparse as sparse
+
+
+def get_bin_matrix(positions, bin_size = 0.1, xmax = 1, ymax = None):
+    '''
+    Builds the matrix averaging the activity of the neurons over regions of the plane.
+    :parameters:
+        - positions: array of shape (N,2), the positions of the neurons.
+        - bin_size: optional, the width of the bins (or the side of the cells).
+        - xmax: optional, the width of the plane.
+        - ymax: optional. If None, the regions are vertical bins along x. Else, the regions are the cells of a grid covering [0,xmax]x[0,ymax],
+          indexed as ix * number of rows + iy.
+    :output:
+        A tuple (matrix, edges, counts):
+        - matrix: sparse matrix of shape (R,N), matrix @ activity gives the mean activity of each region (0 for an empty region).
+        - edges: the edges of the bins along x (as used by np.histogram).
+        - counts: the number of neurons in each region.
+    '''
+    edges = np.arange(0, xmax + bin_size, bin_size)
+    region = np.searchsorted(edges, positions[:,0], side = "right") - 1     #Bin i holds edges[i] <= x < edges[i+1].
+    inside = (region >= 0) * (region < len(edges) - 1)
+    nb_regions = len(edges) - 1
+    if ymax is not None:
+        y_edges = np.arange(0, ymax + bin_size, bin_size)
+        row = np.searchsorted(y_edges, positions[:,1], side = "right") - 1
+        inside *= (row >= 0) * (row < len(y_edges) - 1)
+        region = region * (len(y_edges) - 1) + row
+        nb_regions *= len(y_edges) - 1
+    neurons = np.flatnonzero(inside)
+    counts = np.bincount(region[neurons], minlength = nb_regions)
+    weights = 1 / counts[region[neurons]]
+    matrix = sparse.csr_matrix((weights, (region[neurons], neurons)), shape = (nb_regions, len(positions)))
+    return matrix, edges, counts
+
+
+class Activity_statistics:
+    '''
+    Collects, step by step, the mean activity of each region, and its statistics over time.
+    Given to a Spatial_ESN with begin_statistics, it is updated at each step of the network.
+    '''
+    def __init__(self, positions, bin_size = 0.1, ymax = None, per_neuron = False, keep_history = True):
+        '''
+        :parameters:
+            - positions, bin_size, ymax: see get_bin_matrix.
+            - per_neuron: optional, False by default. Wether the statistics over time of each neuron are also computed (costs O(N) per step).
+            - keep_history: optional, True by default. Wether the mean activity of each region is kept for each step (used by the displays).
+        '''
+        self.matrix, self.edges, self.counts = get_bin_matrix(positions, bin_size = bin_size, ymax = ymax)
+        self.bin_size = bin_size
+        self.ymax = ymax
+        self.per_neuron = per_neuron
+        self.keep_history = keep_history
+        self.history = []
+        self.regions = _Welford(self.matrix.shape[0])
+        self.neurons = _Welford(len(positions)) if per_neuron else None
+
+    def push(self, activity):
+        '''
+        Adds the activity of one step.
+        '''
+        values = self.matrix @ activity
+        self.regions.push(values)
+        if self.per_neuron:
+            self.neurons.push(activity)
+        if self.keep_history:
+            self.history.append(values)
+
+    def get_history(self):
+        '''
+        Returns the mean activity of each region at each step, array of shape (T,R).
+        '''
+        return np.array(self.history).reshape(-1, self.matrix.shape[0])
+
+    def get_statistics(self):
+        '''
+        Returns a dictionary with the statistics over time of the mean activity of each region ("regions"),
+        and of each neuron ("neurons", only if per_neuron is True): number of steps, mean, variance, min and max.
+        '''
+        statistics = {"regions" : self.regions.get()}
+        if self.per_neuron:
+            statistics["neurons"] = self.neurons.get()
+        return statistics
+
+
+class _Welford:
+    '''
+    Online mean, variance, min and max of a stream of vectors.
+    '''
+    def __init__(self, size):
+        self.count = 0
+        self.mean = np.zeros((size))
+        self.M2 = np.zeros((size))
+        self.min = np.full((size), np.inf)
+        self.max = np.full((size), -np.inf)
+
+    def push(self, values):
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.M2 += delta * (values - self.mean)
+        np.minimum(self.min, values, out = self.min)
+        np.maximum(self.max, values, out = self.max)
+
+    def get(self):
+        return {"count" : self.count, "mean" : self.mean.copy(), "variance" : self.M2 / max(self.count, 1),
+                "min" : self.min.copy(), "max" : self.max.copy()}
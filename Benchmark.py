@@ -0,0 +1,333 @@
+'''
+Benchmark of the Spatial ESN: construction, stepping, training, simulation and display, for several sizes of reservoir.
+Everything runs headless on mackey-glass.npy, and the timings are written as json.
+
+Usage:
+    python Benchmark.py [--sizes 400 2000] [--output benchmark.json] [--source directory] [--threads 1 2 4] [--intern_sparsity 0.15]
+    python Benchmark.py --scaling [--sizes 10000 50000 100000 200000] [--intern_sparsity 0.01]
+    python Benchmark.py --compare old.json new.json [--threshold 0.2]
+    python Benchmark.py --revisions old_revision new_revision [--sizes 400 2000]
+
+--source benchmarks the Spatial_ESN.py found in another directory (a checkout of another revision for example).
+--scaling only times the construction and the update, serial and parallel with each number of threads, and prints the thread scaling.
+The storage of W (dense or sparse) is chosen by the Planner for each size, and a size that doesn't fit in memory is skipped.
+--revisions checks out both git revisions in temporary worktrees, benchmarks them and compares the results.
+'''
+import argparse
+import contextlib
+import inspect
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")       #Headless: plt.show does nothing.
+import matplotlib.animation as animation
+
+import Instrumentation
+import Planner
+
+_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Default parameters
+_data = {
+    "seed" : 21,
+    "sizes" : [400, 2000, 10000, 50000],
+    "len_warmup" : 100,
+    "len_training" : 500,
+    "nb_steps" : 200,           #Number of steps timed for update and for the closed-loop simulation.
+    "nb_frames" : 50,           #Number of recorded states rendered by end_record.
+    "threshold" : 0.2,          #Relative slowdown above which a phase is flagged as a regression.
+    "memory_ratio" : 0.5,       #Sizes that would use more than this share of the available memory (see Planner.plan) are skipped.
+    "threads" : None,           #Numbers of threads timed for the parallel update. Powers of 2 up to the number of cores by default.
+    "intern_sparsity" : 0.15,   #Radius of the connections inside the reservoir. W has about N² of them at a fixed radius: lower it for the largest sizes.
+    "scaling" : False,          #Wether only the construction and the update are timed (see --scaling).
+    "scaling_sizes" : [10000, 50000, 100000, 200000],
+}
+
+PHASES = ["generation_Bridson", "reset_reservoir", "update", "train", "simulation", "end_record_setup", "end_record_render", "disp_connectivity"]
+#The parallel update adds a phase "update_threads_<number of threads>" for each number of threads.
+
+#----------------------------------------------------------------------------------------------------------------------
+
+def get_git_revision(directory):
+    ''' Returns the hash of the revision checked out in directory, or "" if it isn't a git repository. '''
+    try:
+        answer = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = directory, stderr = subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+    return answer.decode("utf8").strip("\n")
+
+def get_thread_counts():
+    ''' Returns the powers of 2 below the number of cores, and the number of cores. '''
+    cores = os.cpu_count() or 1
+    return sorted(set([2**k for k in range(cores.bit_length()) if 2**k < cores] + [cores]))
+
+def get_phases(results):
+    ''' Returns the phases of results: PHASES, followed by the parallel updates sorted by number of threads. '''
+    threads = [phase for phase in results if phase.startswith("update_threads_")]
+    return PHASES + sorted(threads, key = lambda phase : int(phase.split("_")[-1]))
+
+def timed(function, *args, **kwargs):
+    '''
+    Calls function silently (its prints and warnings are discarded) and returns (result, duration in seconds).
+    '''
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        begin = time.perf_counter()
+        result = function(*args, **kwargs)
+        duration = time.perf_counter() - begin
+    return result, duration
+
+def get_plan(number_neurons, parameters, weight_formats):
+    '''
+    Chooses the storage of W for one size with Planner.plan, from the memory its phases need (the number of nonzeros of W for a sparse one).
+    The precision stays float64, so that the revisions compared step the same way. Raises MemoryError if the size doesn't fit.
+    :parameters:
+        - weight_formats : the storages the benchmarked revision has (only dense in the older ones).
+    '''
+    budget = parameters["memory_ratio"] * Planner.get_available_memory()
+    plans = []
+    for weight_format in weight_formats:
+        try:
+            plans.append(Planner.plan(number_neurons, parameters["len_warmup"], 0 if parameters["scaling"] else parameters["len_training"],
+                                      parameters["nb_steps"], intern_sparsity = parameters["intern_sparsity"], recorder = "none" if parameters["scaling"] else "full",
+                                      weight_format = weight_format, dtype = "float64", memory_budget = budget,
+                                      instrumentation = Instrumentation.Instrumentation(enabled = False)))
+        except MemoryError as error:
+            message = str(error)
+    if len(plans) == 0:
+        raise MemoryError(message)
+    return min(plans, key = lambda plan : plan["time"]["total"])
+
+def benchmark_size(module, number_neurons, input, parameters, weight_format = "dense"):
+    '''
+    Times every phase for one size of reservoir, or only the construction and the update if parameters["scaling"].
+    :parameters:
+        - module : the Spatial_ESN module benchmarked.
+        - number_neurons : the requested size of the reservoir.
+        - input : the input series.
+        - parameters : a dictionary like _data.
+        - weight_format : optional, the storage of W (see get_plan).
+    :output:
+        A dictionary associating to each phase a dictionary with its duration in "seconds" (and "steps_per_second" for the stepping phases),
+        or with an "error" if the phase failed.
+    '''
+    results = {}
+    np.random.seed(parameters["seed"])
+    len_warmup, len_training, nb_steps = parameters["len_warmup"], parameters["len_training"], parameters["nb_steps"]
+
+    def run(phase, function, *args, nb_steps = None, **kwargs):
+        try:
+            result, duration = timed(function, *args, **kwargs)
+        except Exception as exception:
+            results[phase] = {"error" : "{}: {}".format(type(exception).__name__, exception)}
+            return None
+        results[phase] = {"seconds" : duration}
+        if nb_steps is not None:
+            results[phase]["steps_per_second"] = nb_steps / duration
+        return result
+
+    points = run("generation_Bridson", module.generation_Bridson, number_neurons)
+    if points is None:
+        return results
+
+    #The construction is timed without the sampling, which is replaced by the points generated above.
+    sampling = module.generation_Bridson
+    module.generation_Bridson = lambda *args, **kwargs : points
+    options = {} if weight_format == "dense" else {"weight_format" : weight_format}        #The older revisions only have a dense W.
+    try:
+        esn = run("reset_reservoir", module.Spatial_ESN, number_neurons = number_neurons, external_sparsity = 0.3,
+                  intern_sparsity = parameters["intern_sparsity"], number_input = 1, number_output = 1, spectral_radius = 1, leak_rate = 0.7, noise = 0.001,
+                  **options)
+    finally:
+        module.generation_Bridson = sampling
+    if esn is None:
+        return results
+    results["number_neurons"] = int(esn.N)
+    results["weight_format"] = weight_format
+
+    def stepping():
+        for step in range(nb_steps):
+            esn.update(input[step])
+    run("update", stepping, nb_steps = nb_steps)
+    for nb_threads in parameters["threads"] or get_thread_counts():
+        phase = "update_threads_{}".format(nb_threads)
+        try:
+            timed(esn.begin_parallel_update, nb_threads = nb_threads)
+        except Exception as exception:      #Older revisions don't have it.
+            results[phase] = {"error" : "{}: {}".format(type(exception).__name__, exception)}
+            continue
+        run(phase, stepping, nb_steps = nb_steps)
+        esn.end_parallel_update()
+    if parameters["scaling"]:
+        return results
+
+    esn.begin_record()
+    timed(esn.warmup, input[:len_warmup])
+    run("train", esn.train, input[len_warmup:len_warmup + len_training], input[len_warmup:len_warmup + len_training], nb_steps = len_training)
+    if esn.istrained:
+        run("simulation", esn.simulation, nb_steps, nb_steps = nb_steps)
+
+    #Only the last states are rendered, to keep the animation short.
+    esn.len_warmup, esn.len_training = len_warmup, len_training
+    historic = esn.historic[-parameters["nb_frames"]:]
+    module.len_warmup, module.len_training = len_warmup, len_training     #end_record reads them as globals in older revisions.
+    esn.historic = list(historic)
+    run("end_record_setup", esn.end_record, "")
+    if animation.writers.is_available("ffmpeg"):
+        esn.historic = list(historic)
+        with tempfile.TemporaryDirectory() as directory:
+            run("end_record_render", esn.end_record, os.path.join(directory, "benchmark"))
+        if "seconds" in results["end_record_render"] and "seconds" in results["end_record_setup"]:
+            results["end_record_render"]["seconds"] -= results["end_record_setup"]["seconds"]
+    else:
+        results["end_record_render"] = {"error" : "ffmpeg is not available"}
+    esn.historic = list(historic)
+    run("disp_connectivity", esn.disp_connectivity)
+    return results
+
+def run_benchmark(parameters, source = _directory):
+    '''
+    Runs the benchmark for every size of parameters["sizes"], with the Spatial_ESN.py found in source.
+    :output:
+        A dictionary with the parameters, the revision and the results for each size.
+    '''
+    sys.path.insert(0, source)
+    import Spatial_ESN as module
+    if not hasattr(module, "epsilon"):     #Older revisions only define it when run as a script.
+        module.epsilon = 1e-8
+    input = np.load(os.path.join(_directory, "mackey-glass.npy"))[np.newaxis].T
+
+    report = {"timestamp" : time.ctime(), "source" : os.path.abspath(source), "git_hash" : get_git_revision(source),
+              "parameters" : parameters, "results" : {}}
+    weight_formats = Planner.WEIGHT_FORMATS if "weight_format" in inspect.signature(module.Spatial_ESN).parameters else ["dense"]
+    for number_neurons in parameters["sizes"]:
+        #A size that can't fit is skipped rather than swapping or being killed.
+        try:
+            plan = get_plan(number_neurons, parameters, weight_formats)
+        except MemoryError as error:
+            print("N = {}: skipped, {}".format(number_neurons, error))
+            report["results"][str(number_neurons)] = {phase : {"error" : "skipped: insufficient memory"} for phase in PHASES}
+            continue
+        print("N = {} ({} W, about {:.2f} GB)".format(number_neurons, plan["weight_format"], plan["memory"]["peak"] / 1e9))
+        results = benchmark_size(module, number_neurons, input, parameters, weight_format = plan["weight_format"])
+        report["results"][str(number_neurons)] = results
+        for phase in get_phases(results):
+            if phase in results:
+                print("    {:20s}: {}".format(phase, format_result(results[phase])))
+    print_scaling(report)
+    return report
+
+def print_scaling(report):
+    '''
+    Prints the thread scaling of the parallel update for each size: the steps per second, and the speedup over the serial update.
+    '''
+    rows = []
+    for size, results in report["results"].items():
+        serial = results.get("update", {}).get("steps_per_second")
+        for phase in get_phases(results)[len(PHASES):]:
+            if serial is not None and "steps_per_second" in results[phase]:
+                rows.append((size, phase.split("_")[-1], results[phase]["steps_per_second"], results[phase]["steps_per_second"] / serial))
+    if len(rows) == 0:
+        return
+    print("{:>8s} {:>8s} {:>12s} {:>8s}".format("N", "threads", "steps/s", "speedup"))
+    for row in rows:
+        print("{:>8s} {:>8s} {:12.0f} {:8.2f}".format(*row))
+
+def format_result(result):
+    if "error" in result:
+        return result["error"]
+    if "steps_per_second" in result:
+        return "{:.4f} s ({:.0f} steps/s)".format(result["seconds"], result["steps_per_second"])
+    return "{:.4f} s".format(result["seconds"])
+
+def compare(old, new, threshold = _data["threshold"]):
+    '''
+    Compares two benchmark reports, phase by phase and size by size.
+    :parameters:
+        - old, new : two reports, as returned by run_benchmark.
+        - threshold : relative slowdown above which a phase is flagged as a regression.
+    :output:
+        The list of the regressions, as tuples (size, phase, old seconds, new seconds).
+    '''
+    regressions = []
+    print("{:>8s} {:20s} {:>10s} {:>10s} {:>8s}".format("N", "phase", "old (s)", "new (s)", "ratio"))
+    for size in new["results"]:
+        if size not in old["results"]:
+            continue
+        for phase in get_phases(new["results"][size]):
+            old_result, new_result = old["results"][size].get(phase, {}), new["results"][size].get(phase, {})
+            if "seconds" not in old_result or "seconds" not in new_result:
+                continue
+            ratio = new_result["seconds"] / old_result["seconds"] if old_result["seconds"] > 0 else np.inf
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "REGRESSION"
+                regressions.append((size, phase, old_result["seconds"], new_result["seconds"]))
+            elif ratio < 1 - threshold:
+                flag = "improvement"
+            print("{:>8s} {:20s} {:10.4f} {:10.4f} {:8.2f} {}".format(size, phase, old_result["seconds"], new_result["seconds"], ratio, flag))
+    print("{} regression(s) above {:.0f}%".format(len(regressions), 100 * threshold))
+    return regressions
+
+def benchmark_revisions(old_revision, new_revision, parameters):
+    '''
+    Benchmarks two git revisions of the repository (in temporary worktrees, with this version of the benchmark), and compares them.
+    '''
+    reports = []
+    with tempfile.TemporaryDirectory() as directory:
+        for index, revision in enumerate([old_revision, new_revision]):
+            worktree = os.path.join(directory, "revision_{}".format(index))
+            output = os.path.join(directory, "revision_{}.json".format(index))
+            subprocess.check_call(['git', 'worktree', 'add', '--detach', worktree, revision], cwd = _directory)
+            try:
+                subprocess.check_call([sys.executable, os.path.abspath(__file__), "--source", worktree, "--output", output,
+                                       "--intern_sparsity", str(parameters["intern_sparsity"]), "--sizes"] + [str(size) for size in parameters["sizes"]] +
+                                      (["--threads"] + [str(number) for number in parameters["threads"]] if parameters["threads"] else []) +
+                                      (["--scaling"] if parameters["scaling"] else []))
+            finally:
+                subprocess.check_call(['git', 'worktree', 'remove', '--force', worktree], cwd = _directory)
+            with open(output) as infile:
+                reports.append(json.load(infile))
+    return compare(reports[0], reports[1], parameters["threshold"])
+
+#----------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark of the Spatial ESN.")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = None,
+                        help = "the numbers of neurons benchmarked ({} by default, {} with --scaling)".format(_data["sizes"], _data["scaling_sizes"]))
+    parser.add_argument("--output", default = "benchmark.json", help = "where the results are written")
+    parser.add_argument("--source", default = _directory, help = "the directory containing the Spatial_ESN.py benchmarked")
+    parser.add_argument("--compare", nargs = 2, metavar = ("OLD", "NEW"), help = "compares two json results instead of running the benchmark")
+    parser.add_argument("--revisions", nargs = 2, metavar = ("OLD", "NEW"), help = "benchmarks and compares two git revisions")
+    parser.add_argument("--threads", type = int, nargs = "+", default = _data["threads"], help = "the numbers of threads timed for the parallel update")
+    parser.add_argument("--threshold", type = float, default = _data["threshold"], help = "relative slowdown flagged as a regression")
+    parser.add_argument("--intern_sparsity", type = float, default = _data["intern_sparsity"], help = "the radius of the connections inside the reservoir")
+    parser.add_argument("--scaling", action = "store_true", help = "only times the construction and the update, serial and with each number of threads")
+    arguments = parser.parse_args()
+
+    sizes = arguments.sizes if arguments.sizes is not None else _data["scaling_sizes" if arguments.scaling else "sizes"]
+    parameters = dict(_data, sizes = sizes, threshold = arguments.threshold, threads = arguments.threads, intern_sparsity = arguments.intern_sparsity,
+                      scaling = arguments.scaling)
+    if arguments.compare:
+        reports = []
+        for filename in arguments.compare:
+            with open(filename) as infile:
+                reports.append(json.load(infile))
+        regressions = compare(reports[0], reports[1], arguments.threshold)
+    elif arguments.revisions:
+        regressions = benchmark_revisions(arguments.revisions[0], arguments.revisions[1], parameters)
+    else:
+        report = run_benchmark(parameters, arguments.source)
+        with open(arguments.output, "w") as outfile:
+            json.dump(report, outfile, indent = 1)
+        regressions = []
+    sys.exit(1 if regressions else 0)
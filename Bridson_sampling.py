@@ -7,16 +7,19 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 
-def Bridson_sampling(width=1.0, height=1.0, radius=0.025, k=30):
+def Bridson_sampling(width=1.0, height=1.0, radius=0.025, k=30, rng=np.random):
     # References: Fast Poisson Disk Sampling in Arbitrary Dimensions
     #             Robert Bridson, SIGGRAPH, 2007
+    # rng: a numpy.random.Generator, or np.random (the global state) by default
+    randint = rng.integers if hasattr(rng, "integers") else rng.randint
+
     def squared_distance(p0, p1):
         return (p0[0]-p1[0])**2 + (p0[1]-p1[1])**2
 
     def random_point_around(p, k=1):
         # WARNING: This is not uniform around p but we can live with it
-        R = np.random.uniform(radius, 2*radius, k)
-        T = np.random.uniform(0, 2*np.pi, k)
+        R = rng.uniform(radius, 2*radius, k)
+        T = rng.uniform(0, 2*np.pi, k)
         P = np.empty((k, 2))
         P[:, 0] = p[0]+R*np.sin(T)
         P[:, 1] = p[1]+R*np.cos(T)
@@ -67,9 +70,9 @@ def Bridson_sampling(width=1.0, height=1.0, radius=0.025, k=30):
             N[(i, j)] = neighborhood(M.shape, (i, j), 2)
 
     points = []
-    add_point((np.random.uniform(0,width), np.random.uniform(0,height)))
+    add_point((rng.uniform(0,width), rng.uniform(0,height)))
     while len(points):
-        i = np.random.randint(len(points))
+        i = randint(len(points))
         p = points[i]
         del points[i]
         Q = random_point_around(p, k)
@@ -0,0 +1,167 @@
+'''
+Input series for the Spatial ESN: the bundled Mackey-Glass series, generated Mackey-Glass series of any length, sinus and constant inputs.
+The series are arrays of shape (T,1), memory-mapped from .npy files when they come from the disk, so series much larger than the memory
+can be used (slicing a memory-mapped array only reads the slice). iterate_chunks walks through them chunk by chunk.
+
+Generated series are cached as .npy files named after a hash of their parameters, and written chunk by chunk.
+'''
+import hashlib
+import json
+import os
+
+import numpy as np
+import scipy.signal as signal
+
+_directory = os.path.dirname(os.path.abspath(__file__))
+cache_directory = os.path.join(_directory, "datasets_cache")
+
+# Default parameters of the Mackey-Glass equation dx/dt = beta * x(t-tau) / (1 + x(t-tau)^exponent) - gamma * x(t)
+_mackey_glass = {
+    "tau" : 17,
+    "beta" : 0.2,
+    "gamma" : 0.1,
+    "exponent" : 10,
+    "dt" : 0.1,                 #Integration step.
+    "subsampling" : 10,         #One sample every subsampling integration steps, ie every unit of time by default.
+    "initial_value" : 1.2,      #Value of x at t = 0.
+    "history" : None,           #Value of x for t < 0, initial_value if None (mgdata.dat.txt was generated with 0).
+    "discard" : 1000,           #Number of samples dropped at the beginning, to remove the transient.
+    "normalize" : False,        #If True, tanh(x - 1) is returned, which has the same range as the bundled mackey-glass.npy.
+}
+
+#----------------------------------------------------------------------------------------------------------------------
+
+def iterate_chunks(series, chunk_size, start = 0, stop = None):
+    '''
+    Iterates over a series chunk by chunk. With a memory-mapped series, only the current chunk is read.
+    :parameters:
+        - series: an array of shape (T,...) (memory-mapped or not).
+        - chunk_size: the number of samples of each chunk (the last one may be shorter).
+        - start, stop: optional, the part of the series iterated over.
+    :output:
+        Yields tuples (index of the first sample, chunk).
+    '''
+    stop = len(series) if stop is None else min(stop, len(series))
+    for begin in range(start, stop, chunk_size):
+        yield begin, series[begin:min(begin + chunk_size, stop)]
+
+def mackey_glass_chunks(length, chunk_size = 1 << 16, **parameters):
+    '''
+    Integrates the Mackey-Glass delay differential equation, and yields the samples chunk by chunk.
+    The decay term is integrated exactly (exponential Euler). The delayed term only depends on the delay line, a ring buffer holding the
+    tau/dt last values: it is consumed and refilled one whole delay at a time, so each block of tau/dt steps is a single linear filter (lfilter).
+    :parameters:
+        - length: the number of samples.
+        - chunk_size: optional, the number of samples per chunk.
+        - parameters: optional, see _mackey_glass.
+    :output:
+        Yields arrays of samples, of shape (chunk_size,) (the last one may be shorter).
+    '''
+    parameters = dict(_mackey_glass, **parameters)
+    beta, gamma, exponent, dt = parameters["beta"], parameters["gamma"], parameters["exponent"], parameters["dt"]
+    subsampling = parameters["subsampling"]
+    delay = max(int(round(parameters["tau"] / dt)), 1)
+    decay = np.exp(-gamma * dt)
+    gain = (1 - decay) / gamma
+
+    history = parameters["initial_value"] if parameters["history"] is None else parameters["history"]
+    ring = np.full((delay), float(history))     #x(t-tau) ... x(t-dt)
+    current = float(parameters["initial_value"])
+    to_discard = parameters["discard"] * subsampling
+    pending = np.zeros((0))          #Integration steps not subsampled yet.
+    chunk, filled, produced = np.zeros((chunk_size)), 0, 0
+    while produced < length:
+        forcing = beta * ring / (1 + ring**exponent)
+        block, _ = signal.lfilter([gain], [1, -decay], forcing, zi = [decay * current])     #block[k] = x(t + (k+1)dt)
+        ring = np.concatenate(([current], block[:-1]))
+        current = block[-1]
+
+        if to_discard > 0:
+            skipped = min(to_discard, delay)
+            to_discard -= skipped
+            block = block[skipped:]
+        pending = np.concatenate((pending, block))
+        samples = pending[subsampling - 1::subsampling]
+        pending = pending[len(samples) * subsampling:]
+        while len(samples) > 0 and produced < length:
+            taken = min(len(samples), chunk_size - filled, length - produced)
+            chunk[filled:filled + taken] = samples[:taken]
+            samples = samples[taken:]
+            filled += taken
+            produced += taken
+            if filled == chunk_size or produced == length:
+                values = chunk[:filled]
+                yield np.tanh(values - 1) if parameters["normalize"] else values.copy()
+                filled = 0
+
+def mackey_glass(length, **parameters):
+    '''
+    Returns a Mackey-Glass series of the given length, as an array of shape (length,1). See mackey_glass_chunks for the parameters.
+    '''
+    return np.concatenate(list(mackey_glass_chunks(length, **parameters)))[np.newaxis].T
+
+def get_cache_path(name, parameters, directory = None):
+    '''
+    Returns the path of the cached .npy file of a series, named after a hash of its parameters.
+    '''
+    key = hashlib.sha1(json.dumps(parameters, sort_keys = True).encode("utf8")).hexdigest()[:16]
+    return os.path.join(cache_directory if directory is None else directory, "{}_{}.npy".format(name, key))
+
+def load_mackey_glass(length, directory = None, chunk_size = 1 << 16, **parameters):
+    '''
+    Returns a memory-mapped Mackey-Glass series of shape (length,1), generated the first time and cached as a .npy file afterward.
+    The file is written chunk by chunk, so the series never has to fit in memory.
+    :parameters:
+        - length: the number of samples.
+        - directory: optional, where the cache is. cache_directory by default.
+        - parameters: optional, see _mackey_glass.
+    '''
+    parameters = dict(_mackey_glass, **parameters)
+    path = get_cache_path("mackey_glass", dict(parameters, length = length), directory)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        temporary = path + ".part"
+        series = np.lib.format.open_memmap(temporary, mode = "w+", dtype = float, shape = (length,1))
+        begin = 0
+        for chunk in mackey_glass_chunks(length, chunk_size = chunk_size, **parameters):
+            series[begin:begin + len(chunk),0] = chunk
+            begin += len(chunk)
+        series.flush()
+        del series
+        os.replace(temporary, path)      #The cache only appears once it is complete.
+    return np.load(path, mmap_mode = "r")
+
+def load_text_series(filename, column = 1, directory = None):
+    '''
+    Loads a column of a text file (like mgdata.dat.txt, "index value" on each line) as a memory-mapped series of shape (T,1),
+    cached as a .npy file so the text is only parsed once.
+    '''
+    path = get_cache_path(os.path.splitext(os.path.basename(filename))[0], {"file" : os.path.abspath(filename), "column" : column,
+                          "modified" : os.path.getmtime(filename)}, directory)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        np.save(path, np.loadtxt(filename, usecols = column, ndmin = 1)[np.newaxis].T)
+    return np.load(path, mmap_mode = "r")
+
+def load_series(label, length = None, **parameters):
+    '''
+    Returns the input series corresponding to a label, as an array of shape (T,1):
+        - "Mackey Glass": the bundled mackey-glass.npy (memory-mapped), 10000 samples. A longer length raises an exception: use "Mackey Glass generated"
+          with normalize = True for a series of the same range, but another one than the bundled file.
+        - "Mackey Glass generated": a generated (and cached) Mackey-Glass series, 10000 samples by default. parameters are passed to load_mackey_glass.
+        - "Sinus": sin(t) + 0.1 cos(10t), with a step of 0.1.
+        - "Constant": a constant input of 10, as a read-only view of a single value (no memory used whatever the length).
+    '''
+    if label == "Mackey Glass":
+        series = np.load(os.path.join(_directory, "mackey-glass.npy"), mmap_mode = "r")[np.newaxis].T
+        if length is not None and length > len(series):
+            raise Exception("The bundled Mackey-Glass series has {} samples, {} were asked for: use \"Mackey Glass generated\"".format(len(series), length))
+        return series[:length]
+    elif label == "Mackey Glass generated":
+        return load_mackey_glass(10000 if length is None else length, **parameters)
+    elif label == "Sinus":
+        t = np.arange(10000 if length is None else length) / 10
+        return (np.sin(t) + 0.1 * np.cos(10*t))[np.newaxis].T
+    elif label == "Constant":
+        return np.broadcast_to(10.0, (1000000 if length is None else length, 1))
+    raise Exception("Unknown series: {}".format(label))
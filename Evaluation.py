@@ -0,0 +1,127 @@
+'''
+Scoring of the predictions of ESN: total error, NRMSE, error at each step of the horizon and valid prediction time.
+Every function works on stacked predictions, of shape (runs, horizon, outputs), so that all the runs of a comparison or of a sweep
+(one per delay, per configuration, per seed...) are scored at once, without Python loops.
+A single run of shape (horizon, outputs) or (horizon,) is also accepted, and treated as one run.
+'''
+import numpy as np
+
+# Default parameters
+_data = {
+    "threshold" : 0.4,          #Normalized error above which a prediction is not considered valid anymore (valid prediction time).
+}
+
+#----------------------------------------------------------------------------------------------------------------------
+
+def stack(predictions):
+    '''
+    Converts predictions into an array of shape (runs, horizon, outputs).
+    :parameters:
+        - predictions: a list of runs (each a list of outputs, as returned by Spatial_ESN.simulation), or an array.
+          An array of dimension 1 or 2 is a single run.
+    '''
+    predictions = np.asarray(predictions, dtype = float)
+    if predictions.ndim == 1:
+        return predictions[np.newaxis,:,np.newaxis]
+    if predictions.ndim == 2:
+        return predictions[np.newaxis]
+    return predictions
+
+def get_windows(series, beginnings, horizon):
+    '''
+    Extracts several windows of a series at once, typically the expected values of several runs.
+    :parameters:
+        - series: array of shape (T,) or (T, outputs).
+        - beginnings: the index of the first value of each window. They can't be negative (a window before the series).
+        - horizon: the length of the windows.
+    :output:
+        An array of shape (runs, horizon, outputs).
+    '''
+    series = np.reshape(series, (len(series), -1))
+    beginnings = np.asarray(beginnings, dtype = int)
+    if np.any(beginnings < 0):
+        raise Exception("Windows beginning before the series: {}".format(beginnings[beginnings < 0]))
+    return series[beginnings[:,np.newaxis] + np.arange(horizon)]
+
+def get_scale(expected):
+    '''
+    Returns the standard deviation of each output of the expected values (over every run and step), used to normalize the errors.
+    '''
+    expected = stack(expected)
+    scale = np.std(expected.reshape(-1, expected.shape[-1]), axis = 0)
+    return np.where(scale > 0, scale, 1)
+
+def total_error(predictions, expected):
+    '''
+    Sums, over the horizon, the euclidean distance between the prediction and the expected value. Returns an array of shape (runs,).
+    '''
+    return np.sum(np.linalg.norm(stack(predictions) - stack(expected), axis = 2), axis = 1)
+
+def error_curves(predictions, expected, scale = None):
+    '''
+    Returns the normalized error at each step of the horizon, array of shape (runs, horizon):
+    the root mean square over the outputs of the error divided by scale (see get_scale, computed from expected by default).
+    '''
+    predictions, expected = stack(predictions), stack(expected)
+    if scale is None:
+        scale = get_scale(expected)
+    return np.sqrt(np.mean(((predictions - expected) / scale)**2, axis = 2))
+
+def nrmse(predictions, expected, scale = None):
+    '''
+    Returns the normalized root mean square error of each run over the whole horizon, array of shape (runs,).
+    '''
+    return np.sqrt(np.mean(error_curves(predictions, expected, scale)**2, axis = 1))
+
+def valid_prediction_time(predictions, expected, threshold = _data["threshold"], scale = None, curves = None):
+    '''
+    Returns, for each run, the number of steps before the normalized error first exceeds threshold (the horizon if it never does).
+    curves can be given if the error curves were already computed.
+    '''
+    if curves is None:
+        curves = error_curves(predictions, expected, scale)
+    exceeded = curves > threshold
+    return np.where(exceeded.any(axis = 1), np.argmax(exceeded, axis = 1), curves.shape[1])
+
+def evaluate(predictions, expected, threshold = _data["threshold"], scale = None):
+    '''
+    Scores a set of runs.
+    :parameters:
+        - predictions, expected: arrays of shape (runs, horizon, outputs), see stack and get_windows.
+        - threshold: optional, see valid_prediction_time.
+        - scale: optional, see error_curves.
+    :output:
+        A dictionary of arrays, with one value per run:
+        - "error": the total error (see total_error).
+        - "nrmse": the NRMSE over the horizon.
+        - "valid_time": the valid prediction time.
+        - "curves": the error curves, of shape (runs, horizon).
+        - "ranking": the indices of the runs, from the best to the worst (lowest NRMSE, then longest valid prediction time).
+    '''
+    predictions, expected = stack(predictions), stack(expected)
+    curves = error_curves(predictions, expected, scale)
+    scores = np.sqrt(np.mean(curves**2, axis = 1))
+    valid_time = valid_prediction_time(predictions, expected, threshold, curves = curves)
+    return {"error" : total_error(predictions, expected),
+            "nrmse" : scores,
+            "valid_time" : valid_time,
+            "curves" : curves,
+            "ranking" : np.lexsort((-valid_time, scores))}
+
+def rank(labels, predictions, expected, threshold = _data["threshold"], scale = None):
+    '''
+    Ranks configurations (delays, parameters...) from their runs. The runs of a same label are averaged.
+    :parameters:
+        - labels: array of shape (runs,), the configuration of each run (any sortable values).
+        - predictions, expected: see evaluate.
+    :output:
+        A tuple (configurations, nrmse, valid_time), sorted from the best configuration to the worst.
+        nrmse and valid_time are the means over the runs of each configuration.
+    '''
+    scores = evaluate(predictions, expected, threshold, scale)
+    configurations, index = np.unique(np.asarray(labels), return_inverse = True)
+    counts = np.bincount(index)
+    mean_nrmse = np.bincount(index, weights = scores["nrmse"]) / counts
+    mean_valid_time = np.bincount(index, weights = scores["valid_time"]) / counts
+    order = np.lexsort((-mean_valid_time, mean_nrmse))
+    return configurations[order], mean_nrmse[order], mean_valid_time[order]
@@ -0,0 +1,153 @@
+'''
+Instrumentation of the Spatial ESN: timing of the phases (construction, sampling, warmup, training, simulation, recording, rendering...),
+counters and peak memory. Everything is emitted as events (dictionaries) through a callback, so the output can be printed (default),
+logged, stored, or dropped, for example inside the worker processes of a parameter sweep.
+
+    import Instrumentation, Spatial_ESN
+    Spatial_ESN.default_instrumentation = Instrumentation.Instrumentation(callback = Instrumentation.logging_callback())
+    Spatial_ESN.default_instrumentation = Instrumentation.Instrumentation(enabled = False)     #Silent, near-zero cost.
+
+The networks created afterward use it, an instrumentation can also be given to each network (parameter instrumentation of Spatial_ESN).
+'''
+import contextlib
+import logging
+import sys
+import time
+
+try:
+    import resource
+except ImportError:     #Not available on Windows, the peak memory is then not reported.
+    resource = None
+
+no_phase = contextlib.nullcontext()      #A phase that measures nothing, for the code paths that must not be timed.
+
+#The labels used when printing the phases.
+_labels = {
+    "construction" : "creation of the network",
+    "sampling" : "blue noise sampling",
+    "warmup" : "warmup",
+    "train" : "training",
+    "simulate" : "simulation without input",
+    "record" : "computing colors",
+    "render" : "rendering of the animation",
+    "connectivity" : "placing the neurons",
+    "copy" : "copying",
+}
+
+def get_peak_memory():
+    '''
+    Returns the peak resident memory of the process so far, in bytes (None if it can't be measured).
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024     #Bytes on macOS, kilobytes elsewhere.
+
+def print_callback(event):
+    '''
+    Prints the events, in the same way as the messages of the Spatial ESN.
+    '''
+    if event["event"] == "message":
+        print(event["text"])
+    elif event["event"] == "begin":
+        print("---Beginning {}---".format(_labels.get(event["phase"],event["phase"])))
+    else:
+        details = ["{:.3f} s".format(event["seconds"])]
+        if event["steps"] > 0:
+            details.append("{} steps, {:.0f} steps/s".format(event["steps"],event["steps_per_second"]))
+        if event["peak_memory"] is not None:
+            details.append("peak memory {:.0f} MB".format(event["peak_memory"] / 1e6))
+        if event.get("error") is not None:
+            details.append("interrupted by {}".format(event["error"]))
+        print("---Done ({}): {}---".format(_labels.get(event["phase"],event["phase"]),", ".join(details)))
+
+def logging_callback(logger = None, level = logging.INFO):
+    '''
+    Returns a callback sending the events to a logger (the "Spatial_ESN" logger by default).
+    '''
+    if logger is None:
+        logger = logging.getLogger("Spatial_ESN")
+    def callback(event):
+        if event["event"] == "message":
+            logger.log(level,event["text"])
+        else:
+            logger.log(level,"%s",event)
+    return callback
+
+class Instrumentation:
+    '''
+    Times the phases of one or several Spatial ESN, and emits what happens through a callback.
+    The steps are counted from the n_iter of the network at the beginning and at the end of a phase, so the step function itself is not slowed down.
+    The NaN checks are counted by the step function (see count), which costs a test only once disabled.
+    '''
+    def __init__(self, callback = print_callback, enabled = True, memory = True):
+        '''
+        :parameters:
+            - callback: optional, called with each event (a dictionary). print_callback by default, None to only keep the totals.
+            - enabled: optional, True by default. If False, nothing is measured nor emitted.
+            - memory: optional, True by default. Wether the peak memory is sampled at the end of each phase.
+        '''
+        self.callback = callback
+        self.enabled = enabled
+        self.memory = memory
+        self.timings = {}       #Total time spent in each phase.
+        self.counters = {"steps" : 0, "nan_checks" : 0}
+        self.peak_memory = None
+
+    def emit(self, event):
+        if self.callback is not None:
+            self.callback(event)
+
+    def message(self, text, *values):
+        '''
+        Emits a message. text is formatted with values only if the instrumentation is enabled.
+        '''
+        if self.enabled:
+            self.emit({"event" : "message", "text" : text.format(*values) if values else text})
+
+    def count(self, name, number = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name,0) + number
+
+    def phase(self, name, esn = None):
+        '''
+        Returns a context manager timing a phase. esn, if given, is used to count the steps done during the phase.
+            with instrumentation.phase("warmup", esn):
+                ...
+        '''
+        if not self.enabled:
+            return no_phase
+        return self._phase(name, esn)
+
+    @contextlib.contextmanager
+    def _phase(self, name, esn):
+        self.emit({"event" : "begin", "phase" : name})
+        first_step = esn.n_iter if esn is not None else 0
+        begin = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as exception:
+            error = repr(exception)
+            raise
+        finally:        #A phase interrupted by an exception ends too, with the error.
+            duration = time.perf_counter() - begin
+            steps = esn.n_iter - first_step if esn is not None else 0
+            self.timings[name] = self.timings.get(name,0) + duration
+            self.counters["steps"] += steps
+            if self.memory:
+                self.peak_memory = get_peak_memory()
+            self.emit({"event" : "end", "phase" : name, "seconds" : duration, "steps" : steps,
+                       "steps_per_second" : steps / duration if duration > 0 else 0.0, "peak_memory" : self.peak_memory if self.memory else None,
+                       "error" : error})
+
+    def summary(self):
+        '''
+        Returns the totals so far: time per phase, counters and peak memory (in bytes).
+        '''
+        return {"timings" : dict(self.timings), "counters" : dict(self.counters), "peak_memory" : self.peak_memory}
+
+    def reset(self):
+        self.timings = {}
+        self.counters = {"steps" : 0, "nan_checks" : 0}
+        self.peak_memory = None
@@ -0,0 +1,89 @@
+'''
+Multi-threaded update of large spatial reservoirs.
+The neurons are split into vertical strips along x. Each strip is given to a thread, which computes the new activity of its neurons
+from its rows of W. As the connections are local, the rows of a strip only read the activity of a few neighbouring strips:
+only these columns are kept, so each thread reads a small block of W instead of whole rows.
+NumPy (dense W) and SciPy (sparse W) release the GIL during the products, so the strips are computed in parallel.
+The state is double buffered: every strip reads the previous activity and writes the new one, with one barrier per step (the end of the step).
+'''
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.sparse as sparse
+
+tanh = np.tanh
+
+
+def get_strips(positions, W, nb_strips):
+    '''
+    Splits the neurons into vertical strips, with about the same number of connections in each strip.
+    :parameters:
+        - positions: array of shape (N,2), the positions of the neurons.
+        - W: the weight matrix (dense or sparse), used to balance the strips.
+        - nb_strips: the number of strips.
+    :output:
+        A list of nb_strips arrays of neuron indices (empty strips are dropped).
+    '''
+    order = np.argsort(positions[:,0], kind = "stable")
+    if sparse.issparse(W):
+        row_sizes = np.diff(sparse.csr_matrix(W).indptr)
+    else:
+        row_sizes = np.count_nonzero(W, axis = 1)
+    cumulated = np.cumsum(row_sizes[order] + 1)       #+1 so that the update of the state itself is counted.
+    bounds = np.searchsorted(cumulated, cumulated[-1] * np.arange(1, nb_strips) / nb_strips)
+    return [strip for strip in np.split(order, bounds) if len(strip) > 0]
+
+class Strip_update:
+    '''
+    Computes the steps of a reservoir strip by strip, in a pool of threads.
+    The weights are copied when the instance is created: a new one must be created if W or W_in change.
+    '''
+    def __init__(self, W, W_in, positions, leak_rate, nb_threads = None, nb_strips = None):
+        '''
+        :parameters:
+            - W, W_in: the weight matrixes of the reservoir. W can be dense or sparse.
+            - positions: array of shape (N,2), the positions of the neurons.
+            - leak_rate: the leak rate of the reservoir.
+            - nb_threads: optional, the number of threads. The number of cores by default.
+            - nb_strips: optional, the number of strips. nb_threads by default.
+        '''
+        self.nb_threads = os.cpu_count() if nb_threads is None else nb_threads
+        self.leak_rate = leak_rate
+        self.N = W.shape[0]
+        strips = get_strips(positions, W, self.nb_threads if nb_strips is None else nb_strips)
+        W = sparse.csr_matrix(W) if sparse.issparse(W) else W
+        self.blocks = []
+        for rows in strips:
+            block = W[rows]
+            if sparse.issparse(block):
+                columns = np.unique(block.indices)
+                block = block[:,columns]
+            else:
+                columns = np.flatnonzero(np.any(block != 0, axis = 0))
+                block = np.ascontiguousarray(block[:,columns])
+            self.blocks.append((rows, columns, block, np.ascontiguousarray(W_in[rows])))
+        self.executor = ThreadPoolExecutor(max_workers = self.nb_threads) if self.nb_threads > 1 else None
+
+    def _step_block(self, block, activity, u, new_activity):
+        rows, columns, W_block, W_in_block = block
+        new_activity[rows] = (1-self.leak_rate) * activity[rows] + self.leak_rate * tanh(W_in_block @ u + W_block @ activity[columns])
+
+    def step(self, activity, u):
+        '''
+        Returns the activity after one step, given the current activity and the input u (bias included).
+        '''
+        new_activity = np.empty_like(activity)
+        if self.executor is None:
+            for block in self.blocks:
+                self._step_block(block, activity, u, new_activity)
+        else:
+            futures = [self.executor.submit(self._step_block, block, activity, u, new_activity) for block in self.blocks]
+            for future in futures:      #The barrier: the step is over once every strip is computed.
+                future.result()
+        return new_activity
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
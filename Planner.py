@@ -0,0 +1,222 @@
+'''
+Execution planner of the Spatial ESN: before anything is built, estimates the memory and the time of a run, and chooses how to run it
+within a memory budget:
+    - the storage of W: "dense" (fastest for small reservoirs) or "sparse" (CSR, its size is linear in the number of connections).
+    - its precision: "float64", or "float32" if float64 doesn't fit (W and the states only, the training statistics stay in float64).
+    - the chunk size of the training: None (the whole design matrix at once), or chunks of steps (see Spatial_ESN.train), which give the same readout.
+    - the recorder of compare_prediction: "full" (every neuron at every step, for the animation), "bins" (the mean of the vertical bins), or "none".
+The plan keeps the recorder and the precision asked for if it can, and is the fastest among those. If nothing fits, MemoryError is raised
+right away, instead of running out of memory partway through a run.
+
+    plan = Planner.plan(number_neurons = 20000, len_warmup = 100, len_training = 1000, nb_iter = 1000)
+    esn = Spatial_ESN.Spatial_ESN(..., weight_format = plan["weight_format"], dtype = plan["dtype"])
+    Spatial_ESN.compare_prediction(esn, ..., recorder = plan["recorder"], chunk_size = plan["chunk_size"])
+
+The estimates are rough (the throughputs of _rates were measured on a single core, see calibrate), but the memory is overestimated rather than not.
+'''
+import time
+
+import numpy as np
+import scipy.sparse as sparse
+
+import Instrumentation
+
+# Default parameters
+_data = {
+    "memory_ratio" : 0.5,           #Share of the available memory used when no budget is given.
+    "base_memory" : 200e6,          #Bytes used by Python, NumPy, SciPy and Matplotlib themselves.
+    "chunk_sizes" : [4096, 1024, 256],      #Chunk sizes of the training tried, from the fastest to the smallest.
+    "sampling_excess" : 1.1,        #The Bridson sampling gives about 10% more neurons than requested.
+    "weight_block_size" : 4096,     #Rows of the spatial W generated at once, see Spatial_ESN.weight_block_size.
+    "bin_size" : 0.1,
+}
+
+# Rough throughputs, see calibrate.
+_rates = {
+    "dense_float64" : 1e9,          #Weights of a dense W multiplied per second.
+    "dense_float32" : 2e9,
+    "sparse_float64" : 3e8,         #Nonzeros of a sparse W multiplied per second.
+    "sparse_float32" : 4e8,
+    "step" : 5e-5,                  #Seconds spent in an update besides the product by W.
+    "sampling" : 4e-4,              #Seconds per neuron of the Bridson sampling.
+    "connection" : 2e-6,            #Seconds per connection of the generation of the spatial W.
+    "gemm" : 2e10,                  #Multiply-adds per second of X^T X.
+    "eigh" : 2e9,                   #K^3 per second of the eigen decomposition of the training statistics.
+}
+
+WEIGHT_FORMATS = ["dense", "sparse"]
+DTYPES = ["float64", "float32"]
+RECORDERS = ["full", "bins", "none"]       #From the most to the least recorded.
+
+#----------------------------------------------------------------------------------------------------------------------
+
+def get_available_memory():
+    ''' Returns the available memory in bytes (Linux only, infinite elsewhere). '''
+    try:
+        with open("/proc/meminfo") as infile:
+            for line in infile:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return np.inf
+
+def estimate_connections(number_neurons, intern_sparsity, topology = "spatial"):
+    '''
+    Estimates the number of nonzeros of W.
+    In a spatial reservoir (see Spatial_ESN.generate_spatial_weights), the neurons fill [0,1]x[0,0.5], and each one is connected to the neurons
+    on its left closer than intern_sparsity with the probability 1 - distance/intern_sparsity: pi intern_sparsity² / 6 times the density on average.
+    The borders are ignored, so it is overestimated by about 15%.
+    '''
+    if topology == "spatial":
+        return int(min(number_neurons**2 * np.pi * intern_sparsity**2 / 3, number_neurons**2 / 2))
+    return int(number_neurons**2 * min(intern_sparsity, 1))
+
+def estimate_memory(number_neurons, len_warmup, len_training, nb_iter, weight_format, dtype, chunk_size, recorder,
+                    intern_sparsity = 0.15, external_sparsity = 0.3, number_input = 1, number_output = 1, topology = "spatial", nb_delays = 1,
+                    bin_size = _data["bin_size"]):
+    '''
+    Estimates the memory of a run of compare_prediction (construction, warmup, training and simulation for each delay, recording and display).
+    :parameters:
+        - number_neurons: the number of neurons (after the sampling).
+        - len_warmup, len_training, nb_iter: the lengths of the phases.
+        - weight_format, dtype, chunk_size, recorder: see plan.
+        - the others: see Spatial_ESN and compare_prediction.
+    :output:
+        A dictionary of bytes: "W" (of every network alive at once), "network" (the other arrays of the networks, training statistics included),
+        "recording" (what is kept during the run), the transient memory of "construction", "training" and "display",
+        and "peak": the base memory, plus everything kept, plus the largest transient.
+    '''
+    N = number_neurons
+    itemsize = np.dtype(dtype).itemsize
+    nnz = estimate_connections(N, intern_sparsity, topology)
+    K = N if topology == "random" else int(np.ceil(N * min(external_sparsity / 2, 1)))    #The neurons seen by the readout.
+    nb_networks = 1 + min(nb_delays - 1, 2)     #compare_prediction keeps the network and builds a copy per delay, while the previous one is still referenced.
+    nb_steps = len_warmup + len_training + nb_iter + 1
+    nb_bins = int(np.ceil(1 / bin_size))
+
+    index_size = 4 if max(nnz, N) < 2**31 else 8
+    W = N**2 * itemsize if weight_format == "dense" else nnz * (itemsize + index_size) + (N + 1) * index_size
+    network = 8 * N * (4 + 2 * number_input + 3 * number_output)       #x, W_in, W_out, W_back, connection_out.
+    if len_training > 0:
+        network += 8 * 2 * K**2        #XtX and its eigenvectors.
+    #The blocks of the CSR in float64 and their concatenation, and the candidates of a block (lists of Python integers returned by the KD-tree).
+    construction = 24 * nnz
+    if topology == "spatial":
+        construction += 56 * min(_data["weight_block_size"], N) * 2 * N * np.pi * intern_sparsity**2
+    training = 8 * ((len_training if chunk_size is None else min(chunk_size, len_training)) * K + 2 * K**2) if len_training > 0 else 0   #X, and the workspace of eigh.
+    if recorder == "full":
+        recording = nb_steps * N * itemsize + 8 * nb_steps * nb_bins
+        display = nb_steps * N * (itemsize + 8 + 8 + 4)      #end_record: the history as one array, its moving mean and the color levels.
+    elif recorder == "bins":
+        recording, display = 8 * nb_steps * nb_bins, 0
+    else:
+        recording, display = 0, 0
+    memory = {"W" : nb_networks * W, "network" : nb_networks * network, "recording" : recording,
+              "construction" : construction, "training" : training, "display" : display}
+    memory["peak"] = _data["base_memory"] + memory["W"] + memory["network"] + recording + max(construction, training, display)
+    return memory
+
+def estimate_time(number_neurons, len_warmup, len_training, nb_iter, weight_format, dtype, intern_sparsity = 0.15, external_sparsity = 0.3,
+                  topology = "spatial", nb_delays = 1, rates = None):
+    '''
+    Estimates the duration of a run of compare_prediction, the rendering of the animation excepted.
+    :output:
+        A dictionary of seconds: "construction", "steps" (every update of every delay), "training" (the regression) and "total".
+    '''
+    rates = _rates if rates is None else dict(_rates, **rates)
+    N = number_neurons
+    nnz = estimate_connections(N, intern_sparsity, topology)
+    K = N if topology == "random" else int(np.ceil(N * min(external_sparsity / 2, 1)))
+    product = N**2 if weight_format == "dense" else nnz
+    step = rates["step"] + product / rates["{}_{}".format(weight_format, dtype)]
+    if topology == "spatial":
+        construction = N * rates["sampling"] + nnz * rates["connection"]
+    else:
+        construction = 300 * nnz / rates["sparse_float64"]     #The spectral radius, with ARPACK.
+    if weight_format == "dense":
+        construction += N**2 / rates["dense_float64"]
+    duration = {"construction" : construction,
+                "steps" : nb_delays * (len_warmup + len_training + nb_iter) * step,
+                "training" : nb_delays * (len_training * K**2 / rates["gemm"] + K**3 / rates["eigh"])}
+    duration["total"] = sum(duration.values())
+    return duration
+
+def plan(number_neurons, len_warmup, len_training, nb_iter, intern_sparsity = 0.15, external_sparsity = 0.3, number_input = 1, number_output = 1,
+         topology = "spatial", nb_delays = 1, bin_size = _data["bin_size"], recorder = "full", weight_format = None, dtype = None,
+         memory_budget = None, rates = None, instrumentation = None):
+    '''
+    Chooses how to run compare_prediction within a memory budget, and prints the plan.
+    :parameters:
+        - number_neurons: the number of neurons requested (the sampling gives a few more, which is accounted for).
+        - len_warmup, len_training, nb_iter: the lengths of the phases.
+        - intern_sparsity, external_sparsity, number_input, number_output, topology: see Spatial_ESN.
+        - nb_delays, bin_size: see compare_prediction.
+        - recorder: optional, the recording wanted (see compare_prediction). A lesser one is chosen if it doesn't fit.
+        - weight_format, dtype: optional, forced if given, chosen otherwise.
+        - memory_budget: optional, the bytes the run may use. _data["memory_ratio"] of the available memory by default.
+        - rates: optional, throughputs replacing the ones of _rates (see calibrate).
+        - instrumentation: optional, where the plan is printed. A new Instrumentation.Instrumentation by default.
+    :output:
+        A dictionary with "weight_format", "dtype", "chunk_size", "recorder", "memory" (see estimate_memory), "time" (see estimate_time) and "budget".
+        Raises MemoryError if no plan fits in the budget.
+    '''
+    instrumentation = Instrumentation.Instrumentation() if instrumentation is None else instrumentation
+    if recorder not in RECORDERS:
+        raise Exception("Unknown recorder: {}".format(recorder))
+    budget = _data["memory_ratio"] * get_available_memory() if memory_budget is None else memory_budget
+    if topology == "spatial":
+        number_neurons = int(number_neurons * _data["sampling_excess"])
+    shape = {"intern_sparsity" : intern_sparsity, "external_sparsity" : external_sparsity, "topology" : topology, "nb_delays" : nb_delays}
+
+    candidates = []
+    for storage in WEIGHT_FORMATS if weight_format is None else [weight_format]:
+        for precision in DTYPES if dtype is None else [dtype]:
+            duration = estimate_time(number_neurons, len_warmup, len_training, nb_iter, storage, precision, rates = rates, **shape)
+            for recording in RECORDERS[RECORDERS.index(recorder):]:
+                for chunk_rank, chunk_size in enumerate([None] + [size for size in _data["chunk_sizes"] if size < len_training]):
+                    memory = estimate_memory(number_neurons, len_warmup, len_training, nb_iter, storage, precision, chunk_size, recording,
+                                             number_input = number_input, number_output = number_output, bin_size = bin_size, **shape)
+                    #What was asked for is kept first, then the fastest plan, then the one with the largest chunks.
+                    key = (RECORDERS.index(recording), DTYPES.index(precision), duration["total"], chunk_rank)
+                    candidates.append((key, {"weight_format" : storage, "dtype" : precision, "chunk_size" : chunk_size, "recorder" : recording,
+                                             "memory" : memory, "time" : duration, "budget" : budget}))
+    fitting = [candidate for candidate in candidates if candidate[1]["memory"]["peak"] <= budget]
+    if len(fitting) == 0:
+        smallest = min(candidates, key = lambda candidate : candidate[1]["memory"]["peak"])[1]
+        raise MemoryError("No plan fits in {:.2f} GB for {} neurons: the smallest ({} {} W, recorder \"{}\") needs {:.2f} GB".format(
+                          budget / 1e9, number_neurons, smallest["weight_format"], smallest["dtype"], smallest["recorder"], smallest["memory"]["peak"] / 1e9))
+    chosen = min(fitting, key = lambda candidate : candidate[0])[1]
+    print_plan(chosen, number_neurons, instrumentation)
+    return chosen
+
+def print_plan(plan, number_neurons, instrumentation):
+    '''
+    Prints a plan (see plan) through instrumentation.
+    '''
+    memory, duration = plan["memory"], plan["time"]
+    instrumentation.message("Plan for about {} neurons: {} {} W, training {}, recorder \"{}\"", number_neurons, plan["weight_format"], plan["dtype"],
+                            "in one go" if plan["chunk_size"] is None else "by chunks of {} steps".format(plan["chunk_size"]), plan["recorder"])
+    instrumentation.message("    memory: {:.2f} GB out of {:.2f} GB (W {:.2f} GB, recording {:.2f} GB, largest transient {:.2f} GB)", memory["peak"] / 1e9,
+                            plan["budget"] / 1e9, memory["W"] / 1e9, memory["recording"] / 1e9,
+                            max(memory["construction"], memory["training"], memory["display"]) / 1e9)
+    instrumentation.message("    time: {:.1f} s (construction {:.1f} s, steps {:.1f} s, training {:.1f} s)", duration["total"], duration["construction"],
+                            duration["steps"], duration["training"])
+
+def calibrate(number_neurons = 4000, density = 0.01, nb_repeats = 20):
+    '''
+    Measures the throughputs of the products by W on this machine, and returns them as a dictionary to give to plan (parameter rates).
+    '''
+    rng = np.random.default_rng(0)
+    rates = {}
+    for dtype in DTYPES:
+        x = rng.uniform(-1, 1, number_neurons).astype(dtype)
+        W = sparse.random(number_neurons, number_neurons, density, format = "csr", dtype = dtype, random_state = 0)
+        for weight_format, W in [("sparse", W), ("dense", rng.uniform(-1, 1, (number_neurons, number_neurons)).astype(dtype))]:
+            W @ x       #Warms the caches up.
+            begin = time.perf_counter()
+            for _ in range(nb_repeats):
+                W @ x
+            size = W.nnz if weight_format == "sparse" else W.size
+            rates["{}_{}".format(weight_format, dtype)] = size * nb_repeats / (time.perf_counter() - begin)
+    return rates
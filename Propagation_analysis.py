@@ -0,0 +1,209 @@
+'''
+Analysis of how the signal travels through a spatial reservoir, from the recorded activity (Spatial_ESN.begin_record, or begin_statistics).
+The activity is averaged in vertical bins along x, then every bin is compared to a reference (the first bin, or the input):
+    - the lag of the peak of their cross-correlation, against the distance along x, gives the propagation speed.
+    - the power spectrum of each bin shows which frequencies survive the propagation.
+    - the amplitude of each bin against the distance gives the attenuation.
+All the bins are processed at once (FFT and Welch along the time axis), so histories of tens of thousands of neurons and steps take seconds.
+
+    results = Propagation_analysis.analyze(np.array(esn.historic), esn.x["position"], bin_size = 0.05)
+    Propagation_analysis.disp_analysis(results)
+'''
+import numpy as np
+import scipy.fft as fft
+import scipy.signal as signal
+import matplotlib.pyplot as plt
+
+import Activity_statistics
+
+# Default parameters
+_data = {
+    "bin_size" : 0.05,
+    "max_lag" : 100,            #Longest lag (in steps) looked for in the cross-correlations.
+    "nperseg" : 256,            #Length of the segments of the Welch power spectrum.
+    "chunk_size" : 4096,        #Number of steps aggregated at once, to bound the memory used.
+}
+
+#----------------------------------------------------------------------------------------------------------------------
+
+def get_bin_history(history, positions, bin_size = _data["bin_size"], chunk_size = _data["chunk_size"]):
+    '''
+    Averages the recorded activity in vertical bins along x, with one sparse product per chunk of steps.
+    :parameters:
+        - history: array of shape (T,N), the activity of each neuron at each step (may be memory-mapped).
+        - positions: array of shape (N,2), the positions of the neurons.
+        - bin_size, chunk_size: optional.
+    :output:
+        A tuple (bin_values of shape (T,B), centers of the bins along x, number of neurons in each bin). The empty bins are removed.
+    '''
+    matrix, edges, counts = Activity_statistics.get_bin_matrix(positions, bin_size = bin_size)
+    bin_values = np.zeros((len(history), matrix.shape[0]))
+    for begin in range(0, len(history), chunk_size):
+        bin_values[begin:begin + chunk_size] = (matrix @ np.asarray(history[begin:begin + chunk_size]).T).T
+    filled = counts > 0
+    return bin_values[:,filled], ((edges[:-1] + edges[1:]) / 2)[filled], counts[filled]
+
+def cross_correlations(bin_values, reference = 0, max_lag = _data["max_lag"]):
+    '''
+    Computes the normalized cross-correlation of every bin with a reference, for lags from -max_lag to max_lag, with one batched FFT.
+    A positive lag means the bin follows the reference.
+    :parameters:
+        - bin_values: array of shape (T,B).
+        - reference: optional, the index of the reference bin, or a series of shape (T,) (the input for example).
+        - max_lag: optional, the longest lag computed.
+    :output:
+        A tuple (lags of shape (2*max_lag+1,), correlations of shape (2*max_lag+1,B)), the correlations being between -1 and 1.
+    '''
+    reference_values = bin_values[:,reference] if np.ndim(reference) == 0 else np.reshape(reference,(-1,))
+    T = len(bin_values)
+    max_lag = min(max_lag, T - 1)
+    centered = bin_values - np.mean(bin_values, axis = 0)
+    centered_reference = reference_values - np.mean(reference_values)
+    size = fft.next_fast_len(2 * T - 1)       #Zero-padded, so that the correlation isn't circular.
+    spectrum = fft.rfft(centered, n = size, axis = 0)
+    reference_spectrum = fft.rfft(centered_reference, n = size)
+    correlations = fft.irfft(np.conj(reference_spectrum)[:,np.newaxis] * spectrum, n = size, axis = 0)
+    correlations = np.concatenate((correlations[-max_lag:], correlations[:max_lag + 1])) if max_lag > 0 else correlations[:1]
+    norms = np.linalg.norm(centered, axis = 0) * np.linalg.norm(centered_reference)
+    correlations /= np.where(norms > 0, norms, 1)
+    return np.arange(-max_lag, max_lag + 1), correlations
+
+def get_peak_lags(lags, correlations, positive = True):
+    '''
+    Returns the lag of the maximum of the cross-correlation of each bin, refined between two steps with a parabola through the peak.
+    :parameters:
+        - positive: optional, True by default. Wether only the non-negative lags are looked at (the signal can't go back in a spatial reservoir).
+    :output:
+        A tuple (lags of the peaks, values of the peaks), arrays of shape (B,).
+    '''
+    if positive:
+        correlations = correlations[lags >= 0]
+        lags = lags[lags >= 0]
+    peaks = np.argmax(correlations, axis = 0)
+    columns = np.arange(correlations.shape[1])
+    inside = (peaks > 0) * (peaks < len(lags) - 1)
+    before = correlations[np.maximum(peaks - 1, 0), columns]
+    peak = correlations[peaks, columns]
+    after = correlations[np.minimum(peaks + 1, len(lags) - 1), columns]
+    curvature = before - 2 * peak + after
+    shift = np.where(inside * (curvature < 0), 0.5 * (before - after) / np.where(curvature < 0, curvature, -1), 0)
+    return lags[peaks] + shift, peak
+
+def fit_speed(distances, lags, weights = None):
+    '''
+    Fits lag = distance / speed + offset, by weighted least squares (analyze weights each bin by the height of its correlation peak).
+    :output:
+        A dictionary with "speed" (in units of x per step, inf if the lags don't grow with the distance), "offset" (in steps) and "r2".
+    '''
+    weights = np.ones(len(lags)) if weights is None else np.asarray(weights)
+    slope, offset = np.polyfit(distances, lags, 1, w = np.sqrt(weights))      #polyfit weights the residuals, not their squares.
+    residuals = lags - (slope * distances + offset)
+    variance = np.sum(weights * (lags - np.average(lags, weights = weights))**2)
+    return {"speed" : 1 / slope if slope > 0 else np.inf, "offset" : offset,
+            "r2" : 1 - np.sum(weights * residuals**2) / variance if variance > 0 else 1.0}
+
+def spectral_power(bin_values, nperseg = _data["nperseg"]):
+    '''
+    Returns the power spectrum of every bin (Welch's method, along the time axis): a tuple (frequencies in cycles per step, power of shape (F,B)).
+    '''
+    return signal.welch(bin_values, nperseg = min(nperseg, len(bin_values)), axis = 0)
+
+def attenuation(bin_values, centers):
+    '''
+    Computes how the amplitude (standard deviation over time) of the activity decreases along x.
+    :output:
+        A dictionary with "amplitude" (of each bin), "relative" (amplitude divided by the one of the first bin, in dB),
+        and "length": the distance over which the amplitude is divided by e, fitted on the non-empty bins (inf if it doesn't decrease).
+    '''
+    amplitude = np.std(bin_values, axis = 0)
+    valid = amplitude > 0
+    relative = np.full(amplitude.shape, -np.inf)
+    relative[valid] = 20 * np.log10(amplitude[valid] / amplitude[valid][0])
+    slope = np.polyfit(centers[valid], np.log(amplitude[valid]), 1)[0] if np.sum(valid) > 1 else 0
+    return {"amplitude" : amplitude, "relative" : relative, "length" : -1 / slope if slope < 0 else np.inf}
+
+def analyze(history, positions, bin_size = _data["bin_size"], reference = 0, max_lag = _data["max_lag"], begin = 0, bin_history = None):
+    '''
+    Runs every analysis on a recorded history.
+    :parameters:
+        - history: array of shape (T,N), see get_bin_history. Can be None if bin_history is given.
+        - positions: array of shape (N,2), the positions of the neurons.
+        - bin_size: optional, the width of the bins along x.
+        - reference: optional, see cross_correlations. Only the steps from begin are used for a reference series as well.
+        - max_lag: optional, see cross_correlations.
+        - begin: optional, the first step analysed (to skip the warmup for example).
+        - bin_history: optional, a tuple (bin_values, centers, counts) already computed (see get_bin_history), for example from Activity_statistics.
+    :output:
+        A dictionary with "centers", "counts", "distances" (of the bins to the reference, on which the speed is fitted), "lags", "correlations",
+        "peak_lags", "peak_correlations", "speed" (see fit_speed), "frequencies", "power" and "attenuation" (see attenuation).
+    '''
+    if bin_history is None:
+        bin_history = get_bin_history(history[begin:], positions, bin_size)
+    else:
+        bin_history = (bin_history[0][begin:],) + tuple(bin_history[1:])
+    bin_values, centers, counts = bin_history
+    if np.ndim(reference) != 0:
+        reference = np.reshape(reference,(-1,))[begin:begin + len(bin_values)]
+    lags, correlations = cross_correlations(bin_values, reference, max_lag)
+    peak_lags, peak_correlations = get_peak_lags(lags, correlations)
+    distances = centers - (centers[reference] if np.ndim(reference) == 0 else 0)
+    speed = fit_speed(distances, peak_lags, weights = np.maximum(peak_correlations, 0) + 1e-12)
+    frequencies, power = spectral_power(bin_values)
+    return {"centers" : centers, "counts" : counts, "distances" : distances, "lags" : lags, "correlations" : correlations,
+            "peak_lags" : peak_lags, "peak_correlations" : peak_correlations, "speed" : speed,
+            "frequencies" : frequencies, "power" : power, "attenuation" : attenuation(bin_values, centers)}
+
+def analyze_esn(esn, bin_size = _data["bin_size"], reference = 0, max_lag = _data["max_lag"], begin = 0):
+    '''
+    Runs analyze on what a Spatial_ESN recorded: the bin history of its statistics if they match (vertical bins of bin_size), else its recorded states
+    (see begin_statistics and begin_record). The other parameters are the ones of analyze.
+    '''
+    statistics = esn.statistics
+    if statistics is not None and statistics.ymax is None and statistics.bin_size == bin_size and len(statistics.history) > 0:
+        filled = statistics.counts > 0
+        edges = statistics.edges
+        bin_history = (statistics.get_history()[:,filled], ((edges[:-1] + edges[1:]) / 2)[filled], statistics.counts[filled])
+        return analyze(None, esn.x["position"], bin_size, reference, max_lag, begin, bin_history = bin_history)
+    if len(esn.historic) == 0:
+        raise Exception("Nothing was recorded, see begin_record or begin_statistics")
+    return analyze(np.asarray(esn.historic), esn.x["position"], bin_size, reference, max_lag, begin)
+
+def disp_analysis(results, savename = ""):
+    '''
+    Displays the results of analyze: the cross-correlations against the lag and the distance, the lag of their peaks against the distance
+    (with the fitted speed), the power spectrum of each bin, and the attenuation.
+    '''
+    figure, axes = plt.subplots(nrows = 2, ncols = 2, figsize = (10,8))
+    centers, lags = results["centers"], results["lags"]
+    axes[0][0].imshow(results["correlations"].T, aspect = "auto", origin = "lower", cmap = "coolwarm", vmin = -1, vmax = 1,
+                      extent = [lags[0], lags[-1], centers[0], centers[-1]])
+    axes[0][0].set_xlabel("Lag (steps)")
+    axes[0][0].set_ylabel("x")
+    axes[0][0].set_title("Cross-correlation with the reference")
+
+    speed = results["speed"]
+    axes[0][1].plot(centers, results["peak_lags"], 'o')
+    if np.isfinite(speed["speed"]):
+        axes[0][1].plot(centers, results["distances"] / speed["speed"] + speed["offset"], '--',
+                        label = "speed: {:.4f} per step (r²: {:.2f})".format(speed["speed"], speed["r2"]))
+        axes[0][1].legend()
+    axes[0][1].set_xlabel("x")
+    axes[0][1].set_ylabel("Lag of the peak (steps)")
+    axes[0][1].set_title("Propagation")
+
+    power = results["power"]
+    axes[1][0].imshow(np.log10(power.T + 1e-20), aspect = "auto", origin = "lower",
+                      extent = [results["frequencies"][0], results["frequencies"][-1], centers[0], centers[-1]])
+    axes[1][0].set_xlabel("Frequency (cycles per step)")
+    axes[1][0].set_ylabel("x")
+    axes[1][0].set_title("Power spectrum (log10)")
+
+    axes[1][1].plot(centers, results["attenuation"]["relative"])
+    axes[1][1].set_xlabel("x")
+    axes[1][1].set_ylabel("Amplitude (dB)")
+    axes[1][1].set_title("Attenuation (length: {:.3f})".format(results["attenuation"]["length"]))
+    figure.tight_layout()
+    if savename != "":
+        figure.savefig(savename)
+    plt.show()
+    plt.close(figure)
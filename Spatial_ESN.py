@@ -6,26 +6,39 @@ import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 import matplotlib.animation as animation
 import scipy.spatial.distance as distance
+from scipy.spatial import cKDTree
+import scipy.sparse as sparse
+import scipy.sparse.csgraph as csgraph
+import scipy.sparse.linalg
 from scipy.spatial import Voronoi,voronoi_plot_2d
 import json
 import time
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
 from math import ceil,floor
 import Bridson_sampling
+import Instrumentation
+import Activity_statistics
+import Datasets
+import Evaluation
+import Parallel_update
+import Planner
 
 # Default parameters
 _data = {
     "seed"           : 21,
-    "label_input" : "Mackey Glass",   #"Mackey Glass", "Sinus" or "Constant" in this case, else must be imported by hand (use the "input" variable name if you want to use the main())
+    "label_input" : "Mackey Glass",   #"Mackey Glass", "Mackey Glass generated", "Sinus" or "Constant" (see Datasets.load_series), else must be imported by hand (use the "input" variable name if you want to use the main())
+    "len_input" : None,                #Length of the input series, None for the default length. Generated series are cached in Datasets.cache_directory.
     "display_animation" : False,
     "display_connectivity" : True,     # If the internal structure is displayed. Allows better understanding and checking.
     "savename" : "",             #The file where the animation is saved
     "number_neurons" : 400,
     "len_warmup" : 100,                #100,
+    "warmup_tolerance" : None,         #If set (ex: 1e-6), the warmup stops once the initial state is forgotten, len_warmup being its maximum length.
     "len_training" : 1000,             #1000,
     "simulation_len" : 1000,
     "delays" : [i for i in range(100)],
-    "delays" : [0],
+    "delays" : [0],                    #Or "auto" to only try the delays estimated from the reservoir structure.
     "external_sparsity" : 0.3,          #The probability of connection to the input/output (distance-based)
     "intern_sparsity" : 0.15,   #The probability of connection inside of the reservoir.
     "spectral_radius" : 1,
@@ -33,10 +46,20 @@ _data = {
     "epsilon" : 1e-8,
     "bin_size" : 0.05,
     "noise" : 0.001,
+    "weight_format" : None,            #"dense" or "sparse" (scipy CSR), the storage of W. Sparse is needed for large reservoirs. None: chosen by Planner.
+    "dtype" : None,                    #"float64" or "float32", the precision of W and of the states. None: chosen by Planner.
+    "recorder" : "full",               #What compare_prediction records: "full", "bins" or "none" (see compare_prediction). Planner may lower it.
+    "memory_budget" : None,            #Bytes a run may use, see Planner. None: a share of the available memory.
+    "nb_workers" : 1,                  #Number of processes generating W. The network doesn't depend on it.
+    "feedback" : False,                #Wether the output is fed back into the reservoir (W_back), see Spatial_ESN.
     "timestamp"      : "",
     "git_branch"     : "",
     "git_hash"       : "",
 }
+epsilon = _data["epsilon"]      #Default regularization of the training. Overwritten by the parameters loaded in the main.
+TOPOLOGIES = ["spatial", "random"]     #The reservoirs Spatial_ESN can build, see its topology parameter.
+weight_block_size = 4096        #Number of rows of W generated from each child seed. Changing it changes the networks generated.
+default_instrumentation = Instrumentation.Instrumentation()    #Used by the networks created without instrumentation. See Instrumentation.py to silence or log the output.
 
 
 #----------------------------------------------------------------------------------------------------------------------
@@ -50,7 +73,7 @@ def sigmoid(x):
 def tanh(x):
     return np.tanh(x)
 
-def generation_Bridson(number_points, k = 30, xmax = 1, ymax = 0.5):
+def generation_Bridson(number_points, k = 30, xmax = 1, ymax = 0.5, rng = np.random):
     '''
     Generates a random sampling of point with blue noise properties.
     Uses the method described in Fast Poisson Disk Sampling in Arbitrary Dimensions, Robert Bridson
@@ -61,11 +84,129 @@ def generation_Bridson(number_points, k = 30, xmax = 1, ymax = 0.5):
         -min_dist: Minimum distance between two points. Analog to r
         -k: limit of samples to choose.
         -xmax, ymax: the rectangle in which the points are set in.
+        -rng: optional, a numpy.random.Generator. The global numpy random state by default.
     :output:
         A numpy array of dimension (number_points,2) containing the points randomly generated
     '''
     optimal_radius =  np.sqrt((xmax * ymax)/(number_points*np.sqrt(3)))
-    return Bridson_sampling.Bridson_sampling(width = xmax, height = ymax, radius = optimal_radius, k = k)
+    return Bridson_sampling.Bridson_sampling(width = xmax, height = ymax, radius = optimal_radius, k = k, rng = rng)
+
+_weights_tree = None      #The positions of the neurons and their KD-tree, set once in each process generating W.
+
+def _set_weights_positions(positions):
+    global _weights_tree
+    _weights_tree = (positions, cKDTree(positions))
+
+def _generate_weights_block(begin, end, intern_sparsity, seed):
+    '''
+    Generates the rows begin to end of the spatial W, as a sparse matrix. See generate_spatial_weights.
+    '''
+    positions, tree = _weights_tree
+    rng = np.random.default_rng(seed)
+    neighbours = tree.query_ball_point(positions[begin:end], r = intern_sparsity, return_sorted = True)
+    sizes = np.array([len(candidates) for candidates in neighbours], dtype = int)
+    rows = np.repeat(np.arange(begin, end), sizes)
+    columns = np.concatenate(neighbours).astype(int) if len(rows) > 0 else np.zeros((0), dtype = int)
+    forward = positions[rows,0] > positions[columns,0]      #Only connects spatially forward (this also removes the self-connections).
+    rows, columns = rows[forward], columns[forward]
+    distances = np.linalg.norm(positions[rows] - positions[columns], axis = 1)
+    connected = distances < rng.uniform(0, intern_sparsity, len(rows))      #The closer the neurons, the more likely they are connected.
+    rows, columns = rows[connected], columns[connected]
+    weights = rng.uniform(-1, 1, len(rows))
+    return sparse.csr_matrix((weights, (rows - begin, columns)), shape = (end - begin, len(positions)))
+
+def generate_spatial_weights(positions, intern_sparsity, seed, nb_workers = 1, block_size = None):
+    '''
+    Generates the internal weights of a spatial reservoir: the neuron j is connected to the neuron i (W[i,j] != 0) with the probability
+    1 - distance/intern_sparsity if it is on its left, with a weight uniform in [-1,1].
+    Only the pairs closer than intern_sparsity can be connected, they are found with a KD-tree, so the cost is linear in the number of connections.
+    The rows are generated by blocks of block_size, each one from its own child seed: the result only depends on seed, not on the number of workers.
+    :parameters:
+        -positions: array of shape (N,2), the positions of the neurons.
+        -intern_sparsity: the maximum distance of a connection.
+        -seed: a numpy.random.SeedSequence.
+        -nb_workers: optional, the number of processes generating the blocks.
+        -block_size: optional, weight_block_size by default.
+    :output:
+        The sparse (CSR) weight matrix, of shape (N,N).
+    '''
+    block_size = weight_block_size if block_size is None else block_size
+    N = len(positions)
+    bounds = list(range(0, N, block_size))
+    seeds = seed.spawn(len(bounds))
+    arguments = ([begin for begin in bounds], [min(begin + block_size, N) for begin in bounds], [intern_sparsity] * len(bounds), seeds)
+    if nb_workers > 1 and len(bounds) > 1:
+        with ProcessPoolExecutor(max_workers = nb_workers, initializer = _set_weights_positions, initargs = (positions,)) as executor:
+            blocks = list(executor.map(_generate_weights_block, *arguments))
+    else:
+        _set_weights_positions(positions)
+        blocks = list(map(_generate_weights_block, *arguments))
+    return sparse.vstack(blocks, format = "csr")
+
+def sample_indices(size, density, rng):
+    '''
+    Draws each integer of [0,size) independently with the probability density, and returns the sorted array of the ones drawn.
+    The gaps between two drawn integers follow a geometric law, so they are sampled directly: the cost is linear in the number drawn, not in size.
+    '''
+    if density >= 1:
+        return np.arange(size)
+    if density <= 0:
+        return np.zeros((0), dtype = np.int64)
+    chunks = []
+    last = -1
+    while last < size:
+        nb_gaps = int((size - last) * density * 1.01) + 64
+        positions = last + np.cumsum(rng.geometric(density, nb_gaps))
+        chunks.append(positions[positions < size])
+        last = positions[-1]
+    return np.concatenate(chunks)
+
+def generate_random_weights(N, density, seed):
+    '''
+    Generates the weights of a regular reservoir: each of the N² connections exists with the probability density, with a weight uniform in [-1,1].
+    The nonzeros are sampled directly (see sample_indices), so the cost is linear in their number.
+    :output:
+        The sparse (CSR) weight matrix, of shape (N,N).
+    '''
+    rng = np.random.default_rng(seed)
+    indices = sample_indices(N * N, density, rng)
+    weights = rng.uniform(-1, 1, len(indices))
+    return sparse.csr_matrix((weights, (indices // N, indices % N)), shape = (N,N))
+
+def get_spectral_radius(W, seed = 0):
+    '''
+    Returns the spectral radius of W (dense or sparse). The largest eigenvalues are found with ARPACK, except for small matrixes.
+    Several eigenvalues are computed, since the eigenvalues of a random matrix crowd on the edge of a disk and a single one may not be the largest.
+    seed sets the starting vector of ARPACK, so that the result is reproducible.
+    '''
+    if W.shape[0] <= 256:
+        return np.max(np.abs(np.linalg.eigvals(W.toarray() if sparse.issparse(W) else W)))
+    v0 = np.random.default_rng(seed).uniform(-1, 1, W.shape[0])
+    try:
+        eigenvalues = scipy.sparse.linalg.eigs(W, k = 6, which = "LM", return_eigenvectors = False, tol = 1e-6, v0 = v0)
+    except scipy.sparse.linalg.ArpackNoConvergence as error:
+        if len(error.eigenvalues) == 0:
+            raise
+        eigenvalues = error.eigenvalues
+    return np.max(np.abs(eigenvalues))
+
+def get_reachable(adjacency, sources):
+    '''
+    Computes which nodes of a graph can be reached from a set of source nodes.
+    :parameters:
+        -adjacency: (N,N) matrix, dense or sparse. adjacency[i,j] != 0 means there is an edge from j to i (same convention as W).
+        -sources: boolean array of shape (N,), the nodes the search starts from.
+    :output:
+        A boolean array of shape (N,), True for the sources and every node reachable from them.
+    '''
+    N = adjacency.shape[0]
+    #We add a virtual node connected to every source, so that a single breadth first search is enough.
+    graph = sparse.vstack((sparse.csr_matrix(adjacency != 0).T, sparse.csr_matrix(np.asarray(sources,dtype = bool)[np.newaxis])))
+    graph = sparse.hstack((graph, sparse.csr_matrix((N+1,1),dtype = bool))).tocsr()
+    nodes = csgraph.breadth_first_order(graph, N, directed = True, return_predecessors = False)
+    reachable = np.zeros((N+1),dtype = bool)
+    reachable[nodes] = True
+    return reachable[:N]
 
 
 #----------------------------------------------------------------------------------------------------------------------
@@ -75,7 +216,8 @@ class Spatial_ESN:
     Notes that this is a specific Echo State Network for training purpose, without the maximum features.
     It may ultimately be a basic one for spatialisation purpose.
     '''
-    def __init__(self,number_neurons, external_sparsity, intern_sparsity, number_input, number_output, spectral_radius, leak_rate, noise, isCopy = False):
+    def __init__(self,number_neurons, external_sparsity, intern_sparsity, number_input, number_output, spectral_radius, leak_rate, noise, isCopy = False, instrumentation = None,
+                 seed = None, weight_format = "dense", nb_workers = 1, topology = "spatial", dtype = "float64", feedback = False):
         '''
         Creates an instance of spatial ESN given some parameters
         :parameters:
@@ -87,30 +229,57 @@ class Spatial_ESN:
             - spectral_radius : the desired spectral radius, depending on how lastong we want the memory to be.
             - leak_rate: The leak_rate on every update, symbolize the amount of information kept/lost.
             - isCopy: Boolean, False by default, defines wether we creating a copy or not. Shouldn't be used, except for method copy of Spatial_ESN.
+            - instrumentation: optional, an Instrumentation.Instrumentation receiving the timings and messages of the network. default_instrumentation if not given.
+            - seed: optional, the seed of the network. Every random draw of the network (construction, initial state, noise) comes from it.
+              If None, it is drawn from the global numpy random state, so np.random.seed still makes the runs reproducible.
+            - weight_format: optional, "dense" (default) or "sparse" (scipy CSR), how W is stored.
+            - nb_workers: optional, the number of processes generating W (see generate_spatial_weights). The network doesn't depend on it.
+            - topology: optional, "spatial" (default) or "random". A random reservoir is a regular ESN (see build_random):
+              intern_sparsity is then the probability of each connection, and the positions of the neurons are only used by the displays.
+            - dtype: optional, "float64" (default) or "float32", the precision of W, W_in and of the states. float32 halves the memory of W and speeds
+              up the update. The training statistics are always computed in float64.
+            - feedback: optional, False by default. Wether the output is fed back into the reservoir through W_back. The feedback goes through the same
+              product as the input (see set_input_weights), and the expected outputs are fed back instead during the training (teacher forcing).
 
         '''
-        if not isCopy:
-            print("---Creation of the Network---")
-        self.number_input = number_input
-        self.number_output = number_output
-        self.N = number_neurons  #How many neurons in our reservoir
-        self.leak_rate = leak_rate
-        self.noise = noise
-        self.isRecording = False
-        self.external_sparsity = external_sparsity
-        self.intern_sparsity = intern_sparsity
-        self.spectral_radius = spectral_radius
-        self.historic = []
-
-        self.ymax = 0.5
-
-        self.reset_reservoir(completeReset = not(isCopy))  #Sets the internal states and weight matrixes.
-
-        #Values initialized later.
-        self.len_warmup = -1
-        self.len_training = -1
-        if not isCopy:
-            print("---Network Created---\n")
+        self.instrumentation = default_instrumentation if instrumentation is None else instrumentation
+        with self.instrumentation.phase("construction") if not isCopy else Instrumentation.no_phase:
+            self.number_input = number_input
+            self.number_output = number_output
+            self.N = number_neurons  #How many neurons in our reservoir
+            self.leak_rate = leak_rate
+            self.noise = noise
+            self.isRecording = False
+            self.statistics = None      #An Activity_statistics.Activity_statistics, see begin_statistics.
+            self.isOnline = False       #Wether the readout is trained at every step (see begin_online_training).
+            self.parallel = None        #A Parallel_update.Strip_update, see begin_parallel_update.
+            self.compact_readout = None #A tuple (indices, weights) computing the output from a few neurons only, see select_readout.
+            self.feedback = feedback
+            self.external_sparsity = external_sparsity
+            self.intern_sparsity = intern_sparsity
+            self.spectral_radius = spectral_radius
+            self.historic = []
+            if weight_format not in ["dense","sparse"]:
+                raise Exception("Unknown weight format: {}".format(weight_format))
+            self.weight_format = weight_format
+            if topology not in TOPOLOGIES:
+                raise Exception("Unknown topology: {}".format(topology))
+            self.topology = topology
+            if dtype not in ["float64","float32"]:
+                raise Exception("Unknown dtype: {}".format(dtype))
+            self.dtype = np.dtype(dtype)
+            self.nb_workers = nb_workers
+            self.seed = np.random.randint(2**31 - 1) if seed is None else seed
+            self.seed_sequence = np.random.SeedSequence(self.seed)      #Each complete reset spawns new children from it.
+            self.rng = np.random.default_rng(self.seed_sequence.spawn(1)[0])     #Used for the initial states and the noise.
+
+            self.ymax = 0.5
+
+            self.reset_reservoir(completeReset = not(isCopy))  #Sets the internal states and weight matrixes.
+
+            #Values initialized later.
+            self.len_warmup = -1
+            self.len_training = -1
 
     def reset_reservoir(self,completeReset = False):
         '''
@@ -119,17 +288,18 @@ class Spatial_ESN:
             -completeReset,optional: Boolean, False by default, True will reset all the weights, used for (re)initialization. Network will need to be trained again in this case.
         '''
         if completeReset:
-            print("---Beginning Blue Noise Sampling---")
-            newpoints =  generation_Bridson(self.N,ymax = self.ymax)      #blueSampling(self.N)
-            #We will have a number of neurons sligthly different from the expexted one, since the Bridson generation does not provide a fixed number of points.
-            print("---Done---")
+            sampling_seed, weights_seed, construction_seed = self.seed_sequence.spawn(3)
+            if self.topology == "spatial":
+                with self.instrumentation.phase("sampling"):
+                    newpoints =  generation_Bridson(self.N,ymax = self.ymax,rng = np.random.default_rng(sampling_seed))      #blueSampling(self.N)
+                #We will have a number of neurons sligthly different from the expexted one, since the Bridson generation does not provide a fixed number of points.
+            else:
+                newpoints = np.random.default_rng(sampling_seed).uniform(0,1,(self.N,2)) * [1,self.ymax]     #Only used by the displays.
 
             self.N = newpoints.shape[0]  #Update to the actual number of neurons generated.
 
-        self.x = np.zeros((self.N),dtype = [("activity",float),("position",float,(2,)),("mean",float)])
-        self.x["activity"] = np.random.uniform(-1,1,(self.N,))   #Internal state of the reservoir. Initialisation might change
-
-        self.x["mean"] = np.copy(self.x["activity"])
+        self.x = np.zeros((self.N),dtype = [("activity",self.dtype),("position",float,(2,))])
+        self.x["activity"] = self.rng.uniform(-1,1,(self.N,))   #Internal state of the reservoir. Initialisation might change
 
         self.istrained = False
         if completeReset:       #Initialization of the weights matrixes.
@@ -141,133 +311,565 @@ class Spatial_ESN:
             #self.x["position"][:,1] = np.random.uniform(0,0.5,(self.N))
             self.x["position"] = newpoints
 
-            self.W = np.random.uniform(-1,1,(self.N,self.N))  #The internal weight matrix
-            distances = distance.cdist(self.x["position"],self.x["position"]) #Computes the distances between each nodes, used for the probability of connection.
-            deltax = np.tile(self.x["position"][:,0],(self.N,1))
-            deltax = (deltax.T - deltax)                                       #Checks if the x-distance is positive between 2 neurons
-
-        #    self.W *= np.random.uniform(-1,1,self.W.shape) < self.external_sparsity * (1- np.eye(self.N))
-            intern_connections = distances < np.random.uniform(0,self.intern_sparsity,(distances.shape))
-            self.W *= intern_connections * (1-np.eye(self.N)) * (deltax > 0)   #Connects spatially
+            if self.topology == "spatial":
+                self.build_spatial(weights_seed,construction_seed)
+            else:
+                self.build_random(weights_seed,construction_seed)
+            self.W = self.W.astype(self.dtype,copy = False)     #Before toarray, so that a dense W is only allocated once.
+            if self.weight_format == "dense":
+                self.W = self.W.toarray()
+            self.y = np.zeros((self.number_output))
 
+            if self.instrumentation.enabled:
+                norm = sparse.linalg.norm(self.W) if sparse.issparse(self.W) else np.linalg.norm(self.W)
+                self.instrumentation.message("Norm of W : {}",norm)
+                self.instrumentation.message("Norm of W / number of connections in W : {}",norm / (self.W.nnz if sparse.issparse(self.W) else np.count_nonzero(self.W)))
 
-            self.W_in = np.random.uniform(-1,1,(self.N, 1 + self.number_input))    #We initialise between -1 and 1 uniformly, maybe to change. The added input will be the bias
+    def build_spatial(self,weights_seed,construction_seed):
+        '''
+        Generates the weights of the spatial reservoir: the connections only go forward along x, the input is connected on the left and the output on the right.
+        W is left sparse, see reset_reservoir.
+        '''
+        self.W = generate_spatial_weights(self.x["position"],self.intern_sparsity,weights_seed,nb_workers = self.nb_workers)  #The internal weight matrix, connected spatially.
 
-            #self.W_in = np.ones((self.N, 1 + self.number_input)) #To better visualize, but to delete !
-            connection_in = np.tile(self.x["position"][:,0],(self.number_input + 1,1)).T/(self.external_sparsity) < (np.random.uniform(0,1,self.W_in.shape))
-            self.W_in *= connection_in
+        rng = np.random.default_rng(construction_seed)
+        W_in = rng.uniform(-1,1,(self.N, 1 + self.number_input))    #We initialise between -1 and 1 uniformly, maybe to change. The added input will be the bias
 
-            self.W_out = np.random.uniform(-1,1,(self.N,self.number_output))
-            #self.connection_out = np.tile(1-self.x["position"][:,0],(self. number_output,1)).T < (np.random.uniform(0,self.external_sparsity,self.W_out.shape))
-            self.connection_out = (1-self.x["position"][:,0]) < (np.random.uniform(0,self.external_sparsity,self.N))  #The neurons connected to the output are connected to all of the exit neurons. (Makes the training easier)
-            if self.number_output == 1:
-                self.W_out *= np.tile(self.connection_out[np.newaxis].T,(self.number_output,1))
-            else:
-                self.W_out *= np.tile(self.connection_out,(self.number_output,1))
+        #W_in = np.ones((self.N, 1 + self.number_input)) #To better visualize, but to delete !
+        connection_in = self.x["position"][:,0,np.newaxis]/(self.external_sparsity) < (rng.uniform(0,1,W_in.shape))
+        W_in *= connection_in
 
+        #The neurons connected to the output are connected to all of the exit neurons. (Makes the training easier)
+        self.W_out = rng.uniform(-1,1,(self.number_output,self.N))
+        self.connection_out = (1-self.x["position"][:,0]) < (rng.uniform(0,self.external_sparsity,self.N))
+        self.W_out *= self.connection_out
 
-            #Spectral radius control:
-            #A matrix taking into account the feedback from the output to the input, trying to imitate the echo state property.
-            pseudo_W = self.W + (self.W_out @ self.W_in[:,1:].T).T     #This allows to have a non triangular matrix, giving a spectral radius different from 0.
+        #W is acyclic (connections only go forward along x), so its spectral radius is 0: it is only scaled.
+        self.W *= self.spectral_radius
 
-            '''
-            current_radius = np.max(np.abs(np.linalg.eigvals(pseudo_W)))
+        #The feedback enters the reservoir on the left, like the input, so that it crosses the reservoir too.
+        W_back = rng.uniform(-1,1,(self.N,self.number_output))
+        W_back *= self.x["position"][:,0,np.newaxis]/(self.external_sparsity) < (rng.uniform(0,1,W_back.shape))
+        self.set_input_weights(W_in,W_back)
 
-            if current_radius == 0.0:
-                raise Exception("Null Spectral radius for generated matrix")
-            else:
-                #self.W *= self.spectral_radius/current_radius            #We normalize the weight matrix to get the desired spectral radius.
-                pass
-            '''
-            self.W *= self.spectral_radius
+    def build_random(self,weights_seed,construction_seed):
+        '''
+        Generates the weights of a regular ESN: each connection exists with the probability intern_sparsity, wherever the neurons are,
+        and W is normalized to the spectral radius. Every neuron is connected to the input and to the output.
+        W is left sparse, see reset_reservoir.
+        '''
+        self.W = generate_random_weights(self.N,self.intern_sparsity,weights_seed)
+        current_radius = get_spectral_radius(self.W,seed = weights_seed)
+        if current_radius == 0.0:
+            raise Exception("Null Spectral radius for generated matrix")
+        self.W *= self.spectral_radius/current_radius            #We normalize the weight matrix to get the desired spectral radius.
+
+        rng = np.random.default_rng(construction_seed)
+        W_in = 0.5 * rng.uniform(-1,1,(self.N, 1 + self.number_input))    #We initialise between -1 and 1 uniformly, maybe to change
+        self.W_out = 0.5 * rng.uniform(-1,1,(self.number_output, self.N))
+        self.connection_out = np.ones((self.N),dtype = bool)
+        self.set_input_weights(W_in,rng.uniform(-1,1,(self.N,self.number_output)))
+
+    def set_input_weights(self,W_in,W_back):
+        '''
+        Stores W_in (N,1 + number_input) and the feedback matrix W_back (N,number_output) side by side, in W_in_back.
+        With the feedback, the bias, the input and the output then go through a single product: W_in_back @ [1, input, output] (see update).
+        self.W_in and self.W_back are views of W_in_back: they can be modified in place, but must be replaced through this method.
+        '''
+        self.W_in_back = np.concatenate((W_in,W_back),axis = 1,dtype = self.dtype)
+        self.W_in = self.W_in_back[:,:1 + self.number_input]
+        self.W_back = self.W_in_back[:,1 + self.number_input:]
 
-            self.W_back = np.random.uniform(-1,1,(self.N,self.number_output))  #The Feedback matrix, not used in the test cases.
-            self.y = np.zeros((self.number_output))
+    def get_input_weights(self):
+        '''
+        Returns the weights applied to [1, input] (W_in), or to [1, input, output] with the feedback (W_in_back).
+        '''
+        return self.W_in_back if self.feedback else self.W_in
 
-            norm = np.linalg.norm(self.W)
-            print("Norm of W :" ,norm)
-            print("Norm of W / number of connections in W : ",norm / np.sum(intern_connections) )
+    def get_drive(self,input,addNoise = False,target = None):
+        '''
+        Returns the vector multiplied by get_input_weights(): the bias, the input (with noise if addNoise), and with the feedback,
+        target if given (teacher forcing), else the current output.
+        '''
+        u = np.concatenate((np.array([1.0]) , input + addNoise * self.generateNoise()))             #We add the bias.
+        if self.feedback:
+            u = np.concatenate((u , self.y if target is None else np.reshape(target,(-1,))))
+        return u
 
-    def update(self,input = np.array([]) ,addNoise = False):
+    def update(self,input = np.array([]) ,addNoise = False, target = None):
         '''
         Advance the process by 1 step, given some input if needed.
+        :parameters:
+            -target, optional: what the output should have been before this step (for a delay of 0, the input itself).
+             Used during an online training (see begin_online_training), and fed back instead of the output if the feedback is on (teacher forcing).
         '''
+        if self.isOnline and target is not None:
+            self.rls_step(target)
         if input.size == 0:
             input = np.zeros((self.number_input))
         else:
             input = np.array(input)
-        u = np.concatenate((np.array([1.0]) , input + addNoise * self.generateNoise()))             #We add the bias.
-        matrixA = np.dot(self.W_in, u)    #We put noise in the input if we are training.
-        matrixB = np.dot(self.W , self.x["activity"])
-        matrixC = 0 #self.W_back @ self.y #Feature deactivated and not tested in this particular case.
-        self.x["activity"] = (1-self.leak_rate) * self.x["activity"] + self.leak_rate * tanh(matrixA + matrixB + matrixC )
+        u = self.get_drive(input,addNoise,target)     #We put noise in the input if we are training.
+        if self.parallel is not None:
+            self.x["activity"] = self.parallel.step(self.x["activity"],u)
+        else:
+            matrixA = self.get_input_weights() @ u      #The input, and the feedback of the output if it is on.
+            matrixB = self.W @ self.x["activity"]      #W can be dense or sparse.
+            self.x["activity"] = (1-self.leak_rate) * self.x["activity"] + self.leak_rate * tanh(matrixA + matrixB)
         if np.isnan(np.sum(self.x["activity"])):    #Mostly for debugging purposes.
             raise Exception("Nan in matrix x : {} \n matrix y: {}".format(self.x["activity"],self.y))
+        self.instrumentation.count("nan_checks")
 
         if self.isRecording:
             self.record_state()
 
-        if self.istrained:
-            self.y = np.dot(self.W_out,self.x["activity"])                     #We use a linear output (no postfunction treatment, should change training if one is added).
+        if self.compact_readout is not None:
+            self.y = self.compact_readout[1] @ self.x["activity"][self.compact_readout[0]]
+        elif self.istrained:
+            self.y = self.W_out @ self.x["activity"]                     #We use a linear output (no postfunction treatment, should change training if one is added).
+
+        if self.statistics is not None:
+            self.statistics.push(self.x["activity"])
 
         self.n_iter +=1
-        self.x["mean"] = (self.x["mean"] * self.n_iter + self.x["activity"]) / (self.n_iter + 1)
 
-    def warmup(self,initial_inputs):
+    def warmup(self,initial_inputs,tolerance = None,nb_copies = 2,targets = None,min_steps = 0):
         """
         Proceeds with the initial warmup, given inputs.
+        :parameters:
+            -tolerance, optional: if given, nb_copies - 1 other states, initialized randomly, are run alongside the reservoir.
+             The warmup stops as soon as they all are within tolerance of the actual state (maximum absolute difference):
+             the initial state is then forgotten (echo state property). len(initial_inputs) is then the maximum length of the warmup.
+            -nb_copies, optional: the number of states compared, the actual one included.
+            -targets, optional: the expected outputs, fed back instead of the output if the feedback is on (see update).
+            -min_steps, optional: with a tolerance, the warmup doesn't stop before this number of steps (the training delay, so that the
+             expected outputs of the training can be taken from the inputs already given).
+        :output:
+            The number of warmup steps done.
         """
-        print("---Beginning warmup---")
-        for input in initial_inputs:
-            self.update(input)  # Warmup period, should have an initialised reservoir at this point.
-        print("---Warmup done---")
+        len_warmup = len(initial_inputs)
+        with self.instrumentation.phase("warmup",self):
+            if tolerance is not None:
+                copies = self.rng.uniform(-1,1,(self.N,nb_copies - 1)).astype(self.dtype)
+            for step,input in enumerate(initial_inputs):
+                fed_back = np.copy(self.y) if targets is None else targets[step]       #The copies are fed back the same signal as the state.
+                self.update(input,target = None if targets is None else targets[step])  # Warmup period, should have an initialised reservoir at this point.
+                if tolerance is not None:
+                    copies = self.step_states(copies,np.tile(np.reshape(input,(-1,1)),(1,nb_copies - 1)),feedback = fed_back)
+                    if step + 1 >= min_steps and np.max(np.abs(copies - self.x["activity"][np.newaxis].T)) < tolerance:
+                        len_warmup = step + 1
+                        break
+        if tolerance is not None:
+            if len_warmup == len(initial_inputs):
+                self.instrumentation.message("Warning: the states did not converge within {} warmup steps",len_warmup)
+            else:
+                self.instrumentation.message("Warmup converged in {} steps",len_warmup)
+        return len_warmup
+
+    def begin_parallel_update(self,nb_threads = None,nb_strips = None):
+        '''
+        Computes the following updates in several threads, the reservoir being split into vertical strips (see Parallel_update).
+        Only worth it for large reservoirs. Must be called again if the weights change (training only changes W_out), or if the feedback is switched.
+        :parameters:
+            -nb_threads, optional: the number of threads, the number of cores by default.
+            -nb_strips, optional: the number of strips, nb_threads by default.
+        '''
+        self.end_parallel_update()
+        self.parallel = Parallel_update.Strip_update(self.W,self.get_input_weights(),self.x["position"],self.leak_rate,nb_threads = nb_threads,nb_strips = nb_strips)
+        self.instrumentation.message("Parallel update: {} strips on {} threads",len(self.parallel.blocks),self.parallel.nb_threads)
+
+    def end_parallel_update(self):
+        '''
+        Goes back to the single-threaded update.
+        '''
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+
+    def harvest_states(self,inputs,begin = 1,expected = None):
+        '''
+        Runs the ESN on the inputs (with noise, as during the training) and collects the states seen by the readout.
+        :parameters:
+            -inputs: the input series.
+            -begin: optional, the first input given. 1 by default (the first state is left at 0), 0 to continue a series given chunk by chunk.
+            -expected: optional, the expected outputs. If the feedback is on, expected[i] is fed back with the input i (teacher forcing).
+        :output:
+            An array X of shape (len(inputs),K), K being the number of neurons connected to the output. X[i] is the state before the input i is given.
+        '''
+        self.readout_index = np.flatnonzero(self.get_output_neurons())     #So that the regression only sees the neurons connected to the output.
+        X = np.zeros((len(inputs),len(self.readout_index)))
+        teacher = expected is not None and self.feedback
+        for i in range(begin,len(inputs)):
+            X[i] = self.x["activity"][self.readout_index]
+            self.update(inputs[i],addNoise = True,target = expected[i] if teacher else None)
+        return X
+
+    def set_statistics(self,X,expected):
+        '''
+        Stores the statistics of the linear regression (X^T X and X^T expected), and their eigen decomposition.
+        Any regularization can then be solved without running the reservoir again, see solve_readout.
+        '''
+        self.reset_statistics()
+        self.accumulate_statistics(X,expected)
+        self.decompose_statistics()
 
-    def train(self,inputs,expected):
+    def reset_statistics(self):
+        self.XtX, self.XtY, self.YtY = 0, 0, 0
+
+    def accumulate_statistics(self,X,expected):
+        '''
+        Adds a chunk of states and of expected outputs to the statistics of the linear regression (see set_statistics).
+        '''
+        expected = np.reshape(expected,(len(expected),-1))
+        self.XtX = self.XtX + X.T @ X
+        self.XtY = self.XtY + X.T @ expected
+        self.YtY = self.YtY + np.sum(expected**2)      #Used to compute the training error of any readout, see select_readout.
+
+    def decompose_statistics(self):
+        '''
+        Computes the eigen decomposition of the accumulated statistics, used by solve_readout.
+        '''
+        self.eigenvalues, self.eigenvectors = np.linalg.eigh(self.XtX)
+        self.projected_XtY = self.eigenvectors.T @ self.XtY
+
+    def solve_readout(self,epsilons):
+        '''
+        Computes the readout for one or several regularization strengths, using the stored statistics (see set_statistics).
+        :parameters:
+            -epsilons: a float, or an array of E floats.
+        :output:
+            The readout of shape (number_output,N) for a float, an array of shape (E,number_output,N) for an array.
+        '''
+        epsilons = np.asarray(epsilons,dtype = float)
+        filters = 1 / (self.eigenvalues + epsilons.reshape(-1,1))         #(E,K), the ridge regression in the eigen basis.
+        coefficients = np.einsum("kj,ej,jo->eok",self.eigenvectors,filters,self.projected_XtY)
+        readouts = np.zeros((len(filters),coefficients.shape[1],self.N))
+        readouts[:,:,self.readout_index] = coefficients
+        return readouts[0] if epsilons.ndim == 0 else readouts
+
+    def train(self,inputs,expected,epsilon = None,chunk_size = None):
         '''
         Trains the ESN given an input, for all the duration of the input, using linear regression.
         The objective of the ESN will be to match the expected result, simulated with the given inputs. It should then be able to evolve on its own.
-        inputs and expected should be of the same size.
-        '''
-        print("---Beginning training---")
-        X = np.zeros((len(inputs),self.N))
-        for i in range(1,len(inputs)):
-            X[i] = self.x["activity"] * self.connection_out    #So that the regression only sees the neurons connected to the output.
-            self.update(inputs[i],addNoise = True)
-        newWeights = np.dot(np.dot(expected.T,X), np.linalg.inv(np.dot(X.T,X) + epsilon*np.eye(self.N)))    #The linear regression
-        self.W_out = newWeights
-        print("---Training done---")
+        inputs and expected should be of the same size. expected can have several columns (one per output): they are all solved at once.
+        If the feedback is on, the expected outputs are fed back during the training (teacher forcing).
+        :parameters:
+            -epsilon, optional: the regularization of the regression. The module-level epsilon by default.
+            -chunk_size, optional: if given, the states are harvested and added to the statistics chunk by chunk, so the memory used doesn't
+             depend on the length of the inputs (which can then be memory-mapped series, see Datasets). The result is the same.
+        '''
+        if epsilon is None:
+            epsilon = globals()["epsilon"]
+        with self.instrumentation.phase("train",self):
+            if chunk_size is None:
+                X = self.harvest_states(inputs,expected = expected)
+                self.set_statistics(X,expected)
+            else:
+                self.reset_statistics()
+                for begin, chunk in Datasets.iterate_chunks(inputs,chunk_size):
+                    X = self.harvest_states(chunk,begin = 1 if begin == 0 else 0,expected = expected[begin:begin + len(chunk)])
+                    self.accumulate_statistics(X,expected[begin:begin + len(chunk)])
+                self.decompose_statistics()
+            self.epsilon = epsilon
+            self.W_out = self.solve_readout(epsilon)    #The linear regression
+            self.compact_readout = None
         self.istrained = True
         self.y = self.W_out @ self.x["activity"]   #Output state of the reservoir. After this, it will be computed from the state of the reservoir in the update function.
 
+    def train_regularization_path(self,inputs,expected,epsilons,len_validation):
+        '''
+        Trains the ESN for a whole grid of regularization strengths at once, and keeps the best one.
+        The last len_validation steps of the inputs are not used for the regression, but to score each readout (one step ahead, with the states of the training).
+        :parameters:
+            -inputs, expected: same as train, the validation segment included.
+            -epsilons: the regularization strengths tried.
+            -len_validation: the number of steps kept for the validation.
+        :output:
+            The mean squared validation error of each regularization strength.
+        '''
+        assert 0 < len_validation < len(inputs) - 1, "Invalid validation length: {}".format(len_validation)
+        with self.instrumentation.phase("train",self):
+            expected = np.reshape(expected,(len(expected),-1))
+            X = self.harvest_states(inputs,expected = expected)
+            self.set_statistics(X[:-len_validation],expected[:-len_validation])
+
+            #The validation predictions of every readout, computed in the eigen basis.
+            epsilons = np.asarray(epsilons,dtype = float)
+            projected_X = X[-len_validation:] @ self.eigenvectors
+            filters = 1 / (self.eigenvalues + epsilons[:,np.newaxis])
+            predictions = np.einsum("tj,ej,jo->eto",projected_X,filters,self.projected_XtY)
+            errors = np.mean((predictions - expected[-len_validation:])**2,axis = (1,2))
+            self.epsilon = epsilons[np.argmin(errors)]
+            self.W_out = self.solve_readout(self.epsilon)
+            self.compact_readout = None
+        for epsilon,error in zip(epsilons,errors):
+            self.instrumentation.message("Epsilon: {:.1e} ---- Validation error : {}",epsilon,error)
+        self.instrumentation.message("Chosen epsilon: {:.1e}",self.epsilon)
+        self.istrained = True
+        self.y = self.W_out @ self.x["activity"]
+        return errors
+
+    def get_training_error(self,index,weights):
+        '''
+        Returns the relative training error sqrt(|Y - X W|² / |Y|²) of a readout using only some of the neurons, from the stored statistics.
+        :parameters:
+            -index: the positions of the neurons in readout_index.
+            -weights: array of shape (len(index),number_output).
+        '''
+        error = self.YtY - 2 * np.sum(weights * self.XtY[index]) + np.sum(weights * (self.XtX[np.ix_(index,index)] @ weights))
+        return np.sqrt(max(error,0) / self.YtY)
+
+    def get_validation_error(self,index,weights,states,expected):
+        '''
+        Returns the relative prediction error sqrt(|Y - X W|² / |Y|²) of a readout using only some of the neurons, on held-out states.
+        :parameters:
+            -index, weights: see get_training_error.
+            -states: array of shape (T,K), the states seen by the readout on the held-out segment (see harvest_states).
+            -expected: array of shape (T,number_output).
+        '''
+        return np.sqrt(np.sum((expected - states[:,index] @ weights)**2) / np.sum(expected**2))
+
+    def select_readout(self,max_neurons = None,target_error = None,method = "greedy",epsilon = None,drop_rate = 0.2,restrict_output = True,validation = None):
+        '''
+        Replaces the readout by one using only a few neurons, chosen from the statistics of the last training (see train): the reservoir isn't run again.
+        The output is then computed from these neurons only, and with restrict_output they become the only ones connected to the output,
+        so that prune can drop every neuron that doesn't lead to them.
+        The readouts are scored by their relative training error (see get_training_error), or by their prediction error on a held-out segment
+        if validation is given (see get_validation_error): the tradeoff then shows how the predictions degrade, not only the fit.
+        :parameters:
+            -max_neurons, target_error: at least one of them. The selection stops once max_neurons are used, or once the relative error
+             reaches target_error (greedy), or before it exceeds target_error (magnitude).
+            -method: optional, "greedy" (forward selection: the neuron reducing the error the most is added, one at a time)
+             or "magnitude" (the neurons with the smallest contributions are dropped, drop_rate of them at a time, and the readout is fitted again).
+            -epsilon: optional, the regularization. The one of the training by default.
+            -drop_rate: optional, see method.
+            -restrict_output: optional, True by default. Wether connection_out is restricted to the selected neurons.
+            -validation: optional, a tuple (inputs, expected) following the training. The states are harvested on a copy, as in train,
+             so the ESN itself isn't run.
+        :output:
+            A dictionary with:
+            - "neurons": the indices of the selected neurons.
+            - "weights": the compact readout, of shape (number_output, number of neurons selected).
+            - "sizes", "errors": the number of neurons and the relative error (on the validation if given, else on the training) at each step
+              of the selection (the tradeoff).
+        '''
+        if max_neurons is None and target_error is None:
+            raise Exception("select_readout needs max_neurons or target_error")
+        if not self.istrained or not hasattr(self,"XtX"):
+            raise Exception("The ESN must be trained before selecting its readout")
+        epsilon = self.epsilon if epsilon is None else epsilon
+        K = len(self.readout_index)
+        if validation is None:
+            score, kind = self.get_training_error, "training"
+        else:
+            validation_expected = np.reshape(validation[1],(len(validation[1]),-1))
+            validation_states = self.copy().harvest_states(validation[0],begin = 0,expected = validation_expected)
+            score, kind = (lambda index,weights : self.get_validation_error(index,weights,validation_states,validation_expected)), "validation"
+        full_error = score(np.arange(K),self.eigenvectors @ (self.projected_XtY / (self.eigenvalues + epsilon)[:,np.newaxis]))
+
+        if method == "greedy":
+            selected, sizes, errors = self._forward_selection(epsilon,K if max_neurons is None else min(max_neurons,K),0 if target_error is None else target_error,score)
+        elif method == "magnitude":
+            selected, sizes, errors = self._magnitude_selection(epsilon,max_neurons,target_error,drop_rate,score)
+        else:
+            raise Exception("Unknown readout selection method: {}".format(method))
+        weights = np.linalg.solve(self.XtX[np.ix_(selected,selected)] + epsilon * np.eye(len(selected)),self.XtY[selected])
+
+        neurons = self.readout_index[selected]
+        self.W_out = np.zeros((self.number_output,self.N))
+        self.W_out[:,neurons] = weights.T
+        self.compact_readout = (neurons,weights.T)
+        if restrict_output:
+            connection_out = np.zeros_like(self.connection_out)
+            connection_out[neurons] = True
+            self.connection_out = connection_out
+        self.y = self.compact_readout[1] @ self.x["activity"][neurons]
+
+        self.instrumentation.message("Readout selection ({}): {} neurons out of {}, relative {} error {:.4f} (all of them: {:.4f})",
+                                     method,len(neurons),K,kind,errors[-1],full_error)
+        for size,error in zip(sizes[::max(1,len(sizes)//10)],errors[::max(1,len(sizes)//10)]):
+            self.instrumentation.message("    {:6d} neurons ---- relative {} error {:.4f}",size,kind,error)
+        return {"neurons" : neurons, "weights" : weights.T, "sizes" : np.array(sizes), "errors" : np.array(errors)}
+
+    def _forward_selection(self,epsilon,max_neurons,target_error,score):
+        '''
+        Greedy forward selection on the stored statistics, see select_readout. The candidates are ranked on the training, score gives the error recorded.
+        The inverse of the regularized X^T X of the selected neurons is updated by blocks, and the gain of every candidate is computed at once.
+        '''
+        diagonal = np.diag(self.XtX) + epsilon
+        selected, sizes, errors = [], [], []
+        inverse = np.zeros((0,0))
+        while len(selected) < max_neurons:
+            B = self.XtX[selected]
+            inverse_B = inverse @ B
+            schur = diagonal - np.sum(B * inverse_B,axis = 0)          #What each candidate brings that the selected neurons don't.
+            residual = self.XtY - inverse_B.T @ self.XtY[selected]
+            gains = np.sum(residual**2,axis = 1) / schur
+            gains[selected] = -np.inf
+            candidate = int(np.argmax(gains))
+            u = inverse_B[:,candidate] / schur[candidate]
+            inverse = np.block([[inverse + np.outer(u,inverse_B[:,candidate]), -u[:,np.newaxis]],
+                                [-u[np.newaxis], np.array([[1 / schur[candidate]]])]])
+            selected.append(candidate)
+            sizes.append(len(selected))
+            errors.append(score(selected,inverse @ self.XtY[selected]))
+            if errors[-1] <= target_error:
+                break
+        return np.array(selected), sizes, errors
+
+    def _magnitude_selection(self,epsilon,max_neurons,target_error,drop_rate,score):
+        '''
+        Magnitude pruning with refit on the stored statistics, see select_readout.
+        The contribution of a neuron is the energy it brings to the output: its squared weights times its squared activity.
+        '''
+        selected = np.arange(len(self.readout_index))
+        kept, sizes, errors = None, [], []
+        smallest = 1 if max_neurons is None else max_neurons
+        while True:
+            weights = np.linalg.solve(self.XtX[np.ix_(selected,selected)] + epsilon * np.eye(len(selected)),self.XtY[selected])
+            error = score(selected,weights)
+            if target_error is not None and error > target_error and kept is not None:
+                break
+            kept = selected
+            sizes.append(len(selected))
+            errors.append(error)
+            if len(selected) <= smallest:
+                break
+            contributions = np.sum(weights**2,axis = 1) * np.diag(self.XtX)[selected]
+            nb_dropped = min(max(1,int(drop_rate * len(selected))),len(selected) - smallest)
+            selected = np.sort(selected[np.argsort(contributions)[nb_dropped:]])
+        return kept, sizes, errors
+
+    def get_compact_readout(self):
+        '''
+        Returns the readout as a tuple (indices of the neurons used, weights of shape (number_output, number of neurons used)).
+        '''
+        if self.compact_readout is not None:
+            return self.compact_readout
+        neurons = np.flatnonzero(np.any(self.W_out != 0,axis = 0))
+        return neurons, self.W_out[:,neurons]
+
+    def begin_online_training(self, forgetting = 1, regularization = 1, update_every = 1):
+        '''
+        Starts training the readout online, with recursive least squares: every update given a target corrects W_out.
+        Only the neurons connected to the output are regressed, so the inverse correlation matrix stays of size KxK.
+        A trained readout is kept and corrected from there. If the statistics of its training are still stored (see train, and select_readout),
+        the online training continues this exact solution, else the trained readout is only the starting point (copies and pruned networks).
+        :parameters:
+            -forgetting, optional: the forgetting factor, 1 by default. Lower values (like 0.999) let the readout follow a drifting series.
+            -regularization, optional: the initial regularization, when the statistics of the training aren't available.
+            -update_every, optional: the readout is only corrected once every update_every targets, to save time.
+        '''
+        trained_index = getattr(self,"readout_index",None)     #The neurons regressed by the last training.
+        self.readout_index = np.flatnonzero(self.get_output_neurons())
+        self.P = np.eye(len(self.readout_index)) / regularization
+        if not self.istrained:
+            self.W_out = np.zeros((self.number_output,self.N))
+        elif np.ndim(getattr(self,"XtX",0)) == 2 and len(self.XtX) == len(trained_index) and np.all(np.isin(self.readout_index,trained_index)):
+            if len(self.readout_index) == len(trained_index):
+                self.P = (self.eigenvectors / (self.eigenvalues + self.epsilon)) @ self.eigenvectors.T      #(X^T X + epsilon I)^-1
+            else:       #The output was restricted by select_readout.
+                positions = np.searchsorted(trained_index,self.readout_index)
+                self.P = np.linalg.inv(self.XtX[np.ix_(positions,positions)] + self.epsilon * np.eye(len(positions)))
+        self.forgetting = forgetting
+        self.update_every = update_every
+        self.online_steps = 0
+        self.isOnline = True
+        self.istrained = True
+        self.compact_readout = None
+        self.y = self.W_out @ self.x["activity"]
+
+    def end_online_training(self):
+        '''
+        Stops the online training, the readout is kept as it is.
+        '''
+        self.isOnline = False
+        self.P = None
+
+    def rls_step(self,target):
+        '''
+        Corrects the readout with recursive least squares, so that the current state gives the target.
+        '''
+        self.online_steps += 1
+        if self.online_steps % self.update_every != 0:
+            return
+        state = self.x["activity"][self.readout_index]
+        P_state = self.P @ state
+        gain = P_state / (self.forgetting + state @ P_state)
+        error = np.reshape(target,(-1,)) - self.W_out[:,self.readout_index] @ state
+        self.W_out[:,self.readout_index] += np.outer(error,gain)
+        self.P -= np.outer(gain,P_state)
+        self.P /= self.forgetting
+
+    def train_online(self,inputs,expected):
+        '''
+        Same as train, but the readout is learnt step by step with recursive least squares: no state matrix is stored.
+        begin_online_training is called if it hasn't been. The online training goes on afterward, until end_online_training.
+        '''
+        if not self.isOnline:
+            self.begin_online_training()
+        with self.instrumentation.phase("train",self):
+            for i in range(1,len(inputs)):
+                self.update(inputs[i],addNoise = True,target = expected[i])
+
     def generateNoise(self):
-        return self.noise * np.random.uniform(-1,1,(self.number_input)) #A random vector beetween -noise and noise
+        return self.noise * self.rng.uniform(-1,1,(self.number_input)) #A random vector beetween -noise and noise
 
-    def simulation(self, nb_iter, inputs = [], expected = [],len_warmup = 0 ,len_training = 0, delay = 0, reset = False):
+    def step_states(self, states, inputs, feedback = None):
+        '''
+        Advances several independent copies of the internal state by one step, without noise, recording or output.
+        :parameters:
+            -states: array of shape (N,C), one state per column.
+            -inputs: array of shape (number_input,C), the input given to each copy.
+            -feedback, optional: the signal fed back to every copy if the feedback is on (a target when teacher forced). The current output by default.
+        :output:
+            The new states, array of shape (N,C).
+        '''
+        u = np.concatenate((np.ones((1,states.shape[1])), inputs))      #We add the bias.
+        if self.feedback:
+            feedback = self.y if feedback is None else np.reshape(feedback,(-1,))
+            u = np.concatenate((u, np.tile(feedback[:,np.newaxis],(1,states.shape[1]))))
+        return (1-self.leak_rate) * states + self.leak_rate * tanh(self.get_input_weights() @ u + self.W @ states)
+
+    def simulation(self, nb_iter, inputs = [], expected = [],len_warmup = 0 ,len_training = 0, delay = 0, reset = False, warmup_tolerance = None, chunk_size = None):
         '''
         Simulates the behaviour of the ESN given :
         - input : a starting sequence, wich will be followed.
+        - expected: the expected output during the training. If empty, the inputs delayed by delay steps are used.
         - nb_iter: number of iteration the ESN will run alone (ie simulate)
         - len_warmup: number of iterations of the warmup sequence.
         - len_training: number of iteration of the training sequence.
         - reset: wether the coeffs of the ESN are reset or not. This will not undo training, and you must use reset_reservoir manually if you want to.
+        - warmup_tolerance: optional, stops the warmup once the initial state is forgotten (see warmup). len_warmup is then the maximum length of the warmup,
+          and the training begins right after it. expected must be left empty, so that it is aligned with the actual warmup.
+          The warmup lasts at least delay steps, so that the expected outputs can be taken from the inputs.
+        With the feedback, the warmup is teacher forced with the inputs delayed by delay steps if expected is empty. If expected is given, nothing
+        is known of the outputs before the training: the warmup feeds back the current output (zero, or the one of a previous training).
+        - chunk_size: optional, see train.
 
         Input must at least be of length len_warmup + len_training.
         '''
         self.len_warmup = len_warmup
         self.len_training = len_training
         assert len_warmup + len_training <= len(inputs), "Insufficient input size"
+        assert warmup_tolerance is None or len(expected) == 0, "expected can't be given with an adaptive warmup"
         if reset :
             self.reset_reservoir()  #initial reset for multiple calls
         if len_warmup > 0 :
-            self.warmup(inputs[:len_warmup])
+            targets = None
+            if self.feedback and len(expected) == 0:     #The warmup is teacher forced too, with the inputs delayed (the first ones are repeated).
+                targets = np.asarray(inputs)[np.maximum(np.arange(len_warmup) - delay,0)]
+            self.len_warmup = self.warmup(inputs[:len_warmup],tolerance = warmup_tolerance,targets = targets,min_steps = delay)
         if len_training > 0 :
-            self.train(inputs[len_warmup:len_warmup+len_training],expected[:len_training])
-        print("---Begining simulation without input---")
+            if len(expected) == 0:
+                assert delay <= self.len_warmup, "The delay ({}) can't be longer than the warmup ({} steps)".format(delay,self.len_warmup)
+                expected = inputs[self.len_warmup - delay:self.len_warmup - delay + len_training]
+            self.train(inputs[self.len_warmup:self.len_warmup+len_training],expected[:len_training],chunk_size = chunk_size)
         predictions = []
-        for _ in range(nb_iter):
-            self.update(self.y)
-            predictions.append(self.y)
-        print("---Simulation done---")
+        with self.instrumentation.phase("simulate",self):
+            for _ in range(nb_iter):
+                self.update(self.y)
+                predictions.append(self.y)
         return predictions
 
     def begin_record(self):
@@ -275,90 +877,110 @@ class Spatial_ESN:
         self.historic = []
         self.record_state()
 
+    def begin_statistics(self, bin_size = 0.1, grid = False, per_neuron = False, keep_history = True):
+        '''
+        Starts collecting the mean activity per region of the reservoir at each step, and its statistics over time (see Activity_statistics.py).
+        Its cost is a sparse product per step, and nothing once end_statistics is called.
+        :parameters:
+            -bin_size, optional: the width of the vertical bins along x (or the side of the cells if grid is True).
+            -grid, optional: False by default. If True, the regions are the cells of a 2D grid instead of vertical bins.
+            -per_neuron, optional: False by default. Wether the statistics over time of each neuron are also computed.
+            -keep_history, optional: True by default. Wether the mean activity of each region is kept for each step. Used by end_record.
+        '''
+        self.statistics = Activity_statistics.Activity_statistics(self.x["position"], bin_size = bin_size, ymax = self.ymax if grid else None,\
+                                                                  per_neuron = per_neuron, keep_history = keep_history)
+        self.statistics.push(self.x["activity"])
+
+    def end_statistics(self):
+        '''
+        Stops collecting the statistics, and returns the Activity_statistics object.
+        '''
+        statistics = self.statistics
+        self.statistics = None
+        return statistics
+
     def end_record(self,name, bin_len = 0.1, isDisplayed = False):
-        figure = plt.figure(figsize = (5,7))
-    #    figure, axes = plt.subplots(nrows = 2,ncols = 1,sharex = True, frameon=False)
-        title = figure.suptitle("Warmup: Step n°0")
-        gs = gridspec.GridSpec(2, 1, height_ratios=[2,1])
-        axes = [plt.subplot(gs[0]), plt.subplot(gs[1])]
-        bins = np.arange(0, 1 + bin_len, bin_len)
-        bin_position = np.array([(self.x["position"][:,0] >= bins[i]) * (self.x["position"][:,0] < bins[i+1]) for i in range(len(bins)-1)])
-
-        axes[0].set_title("Neurons position and activity")
-
-        #Draws the vertical liines.
-        for x_value in bins[1:]:
-            axes[0].plot([x_value,x_value],[0,0.5],'--',c = 'b')
-
-        #Histogram setup
-        value = [np.mean(self.historic[0]*(self.x["position"][:,0] >= bins[i]) * (self.x["position"][:,0] < bins[i+1])) for i in range(len(bins)-1)]
-        bar = axes[1].bar(bins[:-1] + bin_len / 2 ,value,width = bin_len)
-        axes[1].set_title("Global value according to x position")
-
-        #We add 4 dummy points for display (see https://stackoverflow.com/questions/20515554/colorize-voronoi-diagram)
-        vor = Voronoi(np.concatenate((self.x["position"],np.array([[999,999],[-999,999],[999,-999],[-999,-999]]))))
-        voronoi_plot_2d(vor,axes[0],show_points=False, show_vertices=False, s=1)
-
-        self.historic = np.array(self.historic)
-        nb_states,nb_neurons = self.historic.shape
-        colors_array = np.zeros((nb_states,nb_neurons,4))
-
-        #Creates mean array:
-        len_mean = 20
-        mean_array = np.zeros((nb_states+len_mean,nb_neurons))
-        for j in range(len_mean):
-            mean_array += np.concatenate((np.zeros((j,nb_neurons)),self.historic,np.zeros((len_mean-j,nb_neurons))))
-        mean_array *= 1/len_mean
-
-        print("---Computing colors---")
-        for i in range(self.N):
-            max = np.max(np.abs(self.historic[:,i]))
-            #norm = mpl.colors.Normalize(vmin =  -1 , vmax = 1)  #Each neuron is normalized according to its
-            norm = mpl.colors.Normalize(vmin =  -max , vmax = max)  #Each neuron is normalized according to its maximum value,centered on 0.
-
-            mapper = cm.ScalarMappable(norm = norm, cmap = cm.coolwarm)  #The Voronoi colormap
-            #colors_array[:,i] = mapper.to_rgba(self.historic[:,i])
-            colors_array[:,i] = mapper.to_rgba(mean_array[:-len_mean,i])
-
-        print("---Done---")
-        #list_fills = []
-        polygons = []
-        facecolors = []
-        for neuron_index in range(self.N):
-            region = vor.regions[vor.point_region[neuron_index]]
-            polygon = [vor.vertices[i] for i in region]
-            polygons.append(polygon)
-            facecolors.append((0,0,0,1))
-
-            #list_fills.append(axes[0].fill(*zip(*polygon), color=mapper.to_rgba(self.historic[0][neuron_index])))
-
-
-        axes[0].set_ylim(0,self.ymax)
-        axes[0].set_xlim(0,1)
-
-        axes[0].set_aspect(1)
-        polycollection = mpl.collections.PolyCollection(polygons)
-        #colors_array = mapper.to_rgba(np.copy(self.historic))   #Maps the color of each past activity to display.
-        #colors_array = mapper.to_rgba(self.historic * (1+ 2*self.x["position"][:,0]))   #Maps the color of each past activity to display while amplifying the behaviour for neurons furthers in the reservoir.
-        polycollection.set_facecolors(colors_array[0])
-        polycollection.set_edgecolors("white")
-        axes[0].add_collection(polycollection)
-        figure.tight_layout(pad=3.0)
+        '''
+        Displays (and/or saves as name.mp4) the recorded activity of the neurons, and the mean activity in vertical bins along x.
+        The bin means are taken from the statistics collected since begin_statistics if they match the record, else they are computed in one sparse product.
+        '''
+        with self.instrumentation.phase("record"):
+            figure = plt.figure(figsize = (5,7))
+        #    figure, axes = plt.subplots(nrows = 2,ncols = 1,sharex = True, frameon=False)
+            title = figure.suptitle("Warmup: Step n°0")
+            gs = gridspec.GridSpec(2, 1, height_ratios=[2,1])
+            axes = [plt.subplot(gs[0]), plt.subplot(gs[1])]
+            self.historic = np.array(self.historic)
+            statistics = self.statistics
+            if statistics is not None and statistics.ymax is None and statistics.bin_size == bin_len and len(statistics.history) == len(self.historic):
+                bins, bin_values = statistics.edges, statistics.get_history()
+            else:
+                bin_matrix, bins, _ = Activity_statistics.get_bin_matrix(self.x["position"], bin_size = bin_len)
+                bin_values = (bin_matrix @ self.historic.T).T
+
+            axes[0].set_title("Neurons position and activity")
+
+            #Draws the vertical liines.
+            for x_value in bins[1:]:
+                axes[0].plot([x_value,x_value],[0,0.5],'--',c = 'b')
+
+            #Histogram setup
+            bar = axes[1].bar(bins[:-1] + bin_len / 2 ,bin_values[0],width = bin_len)
+            axes[1].set_title("Mean value according to x position")
+
+            #We add 4 dummy points for display (see https://stackoverflow.com/questions/20515554/colorize-voronoi-diagram)
+            vor = Voronoi(np.concatenate((self.x["position"],np.array([[999,999],[-999,999],[999,-999],[-999,-999]]))))
+            voronoi_plot_2d(vor,axes[0],show_points=False, show_vertices=False, s=1)
+
+            #Moving mean over the last len_mean states (the states before the record count as 0), from a cumulative sum.
+            len_mean = 20
+            mean_array = np.cumsum(self.historic,axis = 0,dtype = float)
+            mean_array[len_mean:] -= mean_array[:-len_mean].copy()
+            mean_array *= 1/len_mean
+
+            #Each neuron is normalized according to its maximum value, centered on 0. The colors are only mapped when a frame is drawn,
+            #so the memory used is a float32 per neuron and per state instead of 4 floats.
+            max = np.max(np.abs(self.historic),axis = 0)
+            color_levels = np.divide(mean_array,2 * max,out = np.zeros(mean_array.shape),where = max > 0).astype(np.float32)
+            color_levels += np.where(max > 0,0.5,0).astype(np.float32)
+            del mean_array
+
+            #list_fills = []
+            polygons = []
+            facecolors = []
+            for neuron_index in range(self.N):
+                region = vor.regions[vor.point_region[neuron_index]]
+                polygon = [vor.vertices[i] for i in region]
+                polygons.append(polygon)
+                facecolors.append((0,0,0,1))
+
+                #list_fills.append(axes[0].fill(*zip(*polygon), color=mapper.to_rgba(self.historic[0][neuron_index])))
+
+
+            axes[0].set_ylim(0,self.ymax)
+            axes[0].set_xlim(0,1)
+
+            axes[0].set_aspect(1)
+            polycollection = mpl.collections.PolyCollection(polygons)
+            #colors_array = mapper.to_rgba(np.copy(self.historic))   #Maps the color of each past activity to display.
+            #colors_array = mapper.to_rgba(self.historic * (1+ 2*self.x["position"][:,0]))   #Maps the color of each past activity to display while amplifying the behaviour for neurons furthers in the reservoir.
+            polycollection.set_facecolors(cm.coolwarm(color_levels[0]))
+            polycollection.set_edgecolors("white")
+            axes[0].add_collection(polycollection)
+            figure.tight_layout(pad=3.0)
 
 
         def update_frame(i):
 
             #Update of the neurons display
             #scat.set_array(self.historic[i])
-            title.set_text("{}: Step n°{}".format("Warmup" if i < len_warmup else ("Training" if i < len_warmup + len_training else "Prediction"),i))
+            title.set_text("{}: Step n°{}".format("Warmup" if i < self.len_warmup else ("Training" if i < self.len_warmup + self.len_training else "Prediction"),i))
 
-            #Update of the histogram
-            value = [np.mean(self.historic[i]* bin_position[j]) for j in range(len(bins)-1)]
-            #We take the mean inside the bin interval
-            for rect,h in zip(bar,value):
+            #Update of the histogram, with the mean inside each bin interval
+            for rect,h in zip(bar,bin_values[i]):
                 rect.set_height(h)
 
-            polycollection.set_facecolors(colors_array[i])
+            polycollection.set_facecolors(cm.coolwarm(color_levels[i]))
             '''
             count = 0
             for fill in list_fills:
@@ -370,12 +992,11 @@ class Spatial_ESN:
             #return bar, list_fills
 
         anim = animation.FuncAnimation(figure, update_frame,frames = np.arange(1,len(self.historic)),interval = 10)
-        if name != "":
-            print("---Saving the animation---")
-            anim.save(name+".mp4", fps=30)
-            print("---Saving done---")
-        if isDisplayed:
-            plt.show()
+        with self.instrumentation.phase("render"):
+            if name != "":
+                anim.save(name+".mp4", fps=30)
+            if isDisplayed:
+                plt.show()
 
         plt.close()
         self.isRecording = False
@@ -393,78 +1014,71 @@ class Spatial_ESN:
         '''
 
         connection_in = (self.W_in != 0)
-        if len(self.connection_out.shape) == 1:
-            connection_out = self.connection_out[np.newaxis].T
-        else:
-            connection_out = self.connection_out
+        connection_out = self.get_output_neurons()
 
         intern_connections = (self.W != 0)
         figure, axes = plt.subplots(nrows=2, ncols=1, figsize=(20,20))
 
-        print("Number of connection to the reservoir : ",np.sum(connection_in))
-        print("Number of connection inside the reservoir : ",np.sum(intern_connections))
-        print("Number of connection to the output : ",np.sum(connection_out))
+        self.instrumentation.message("Number of connection to the reservoir : {}",np.sum(connection_in))
+        self.instrumentation.message("Number of connection inside the reservoir : {}",np.sum(intern_connections))
+        self.instrumentation.message("Number of connection to the output : {}",np.sum(connection_out))
 
         figure.suptitle("{} neurons, external sparsity = {} ".format(self.N, self.external_sparsity))
 
-        print("---Placing the neurons, this migth take a while---")
-        #For the initial display, we show the connection to input and output -> the following lines compute them
-        connection_input = []
-        connection_output = []
-        connection_both = []
-        unrelated = []
-        for i in range(self.N):
-            connected_output = connection_out[i,:].any()
-            connected_input = connection_in[i,:].any()
-            if connected_input and connected_output:
-                connection_both.append(i)
-            elif connected_input:
-                connection_input.append(i)
-            elif connected_output:
-                connection_output.append(i)
-            else:
-                unrelated.append(i)
+        with self.instrumentation.phase("connectivity"):
+            #For the initial display, we show the connection to input and output -> the following lines compute them
+            connection_input = []
+            connection_output = []
+            connection_both = []
+            unrelated = []
+            for i in range(self.N):
+                connected_output = connection_out[i]
+                connected_input = connection_in[i,:].any()
+                if connected_input and connected_output:
+                    connection_both.append(i)
+                elif connected_input:
+                    connection_input.append(i)
+                elif connected_output:
+                    connection_output.append(i)
+                else:
+                    unrelated.append(i)
 
-        #Initialisation of the plots
-        unrelatedNeurons = axes[0].scatter(self.x["position"][unrelated][:,0],self.x["position"][unrelated][:,1],c = 'b')
-        previousNeurons =  axes[0].scatter(self.x["position"][connection_input][:,0],self.x["position"][connection_input][:,1],c = 'r')
-        selectedNeuron =  axes[0].scatter(self.x["position"][connection_both][:,0],self.x["position"][connection_both][:,1],c = 'g')
-        nextNeurons = axes[0].scatter(self.x["position"][connection_output][:,0],self.x["position"][connection_output][:,1],c = 'y')
-        axes[0].legend((previousNeurons,nextNeurons,selectedNeuron),("Connected to the input","Connected to the output","Connected to both"),fontsize=6)
+            #Initialisation of the plots
+            unrelatedNeurons = axes[0].scatter(self.x["position"][unrelated][:,0],self.x["position"][unrelated][:,1],c = 'b')
+            previousNeurons =  axes[0].scatter(self.x["position"][connection_input][:,0],self.x["position"][connection_input][:,1],c = 'r')
+            selectedNeuron =  axes[0].scatter(self.x["position"][connection_both][:,0],self.x["position"][connection_both][:,1],c = 'g')
+            nextNeurons = axes[0].scatter(self.x["position"][connection_output][:,0],self.x["position"][connection_output][:,1],c = 'y')
+            axes[0].legend((previousNeurons,nextNeurons,selectedNeuron),("Connected to the input","Connected to the output","Connected to both"),fontsize=6)
 
-        axes[0].set_aspect(1)
+            axes[0].set_aspect(1)
 
-        #We draw the arrows
-        arrows = []
-        for i in range(self.N):
-            for j in range(self.N):
-                if self.W[i,j] != 0:
-                    arrow = axes[0].plot([self.x["position"][i,0],self.x["position"][j,0]], [self.x["position"][i,1], self.x["position"][j,1]],c = 'b',lw = 0.1)
-                    arrows.append(arrow)
+            #We draw the arrows, looking only at the nonzeros of W (dense or sparse).
+            arrows = []
+            connections = sparse.coo_matrix(self.W)
+            for i,j in zip(connections.row[connections.data != 0],connections.col[connections.data != 0]):
+                arrow = axes[0].plot([self.x["position"][i,0],self.x["position"][j,0]], [self.x["position"][i,1], self.x["position"][j,1]],c = 'b',lw = 0.1)
+                arrows.append(arrow)
 
         arrowDisplayed = [True]
-        print("---Done---")
 
         def onClick(event):
             '''
             When the mouse is clicked, change the focus on the nearest neuron, and display its past activity in the lower plot.
             '''
             index = self.get_nearest_index(event.xdata,event.ydata) #Gets the index of the clicked neuron
-            print("Clicked on neuron {}, with position {}".format(index,self.x["position"][index]))
-
-            #To better visualize the connections of the selected neuron
-            previous = []
-            next = []
-            unrelated = []
-            for j in range(self.N):
-                #We check the relation with the others neurons
-                if j != index:
-                    if self.W[j,index] != 0:
-                        next.append(j)
-                    elif self.W[index,j] != 0:
-                        previous.append(j)
-                    else:
-                        unrelated.append(j)
+            self.instrumentation.message("Clicked on neuron {}, with position {}",index,self.x["position"][index])
+
+            #To better visualize the connections of the selected neuron, from the nonzeros of its column and of its row.
+            isNext = np.zeros(self.N,dtype = bool)
+            isNext[self.W[:,[index]].nonzero()[0]] = True
+            isPrevious = np.zeros(self.N,dtype = bool)
+            isPrevious[self.W[[index]].nonzero()[1]] = True
+            isPrevious *= ~isNext
+            isNext[index] = isPrevious[index] = False
+            next = np.flatnonzero(isNext)
+            previous = np.flatnonzero(isPrevious)
+            unrelated = np.flatnonzero(~(isNext + isPrevious))
+            unrelated = unrelated[unrelated != index]
 
             unrelatedNeurons.set_offsets(self.x["position"][unrelated])
             previousNeurons.set_offsets(self.x["position"][previous])
@@ -510,31 +1124,80 @@ class Spatial_ESN:
 
         figure.canvas.mpl_connect('button_press_event',onClick)
         figure.canvas.mpl_connect('key_press_event',onPress)
-        print("---Displaying---")
         plt.show()
-        print("---Done---")
         plt.close()
 
     def copy(self):
         '''
         Returns an independent copy of the current ESN. Used to compare different ESN with same initialization.
         '''
-        print("---Beginning copying---")
-        buffer = Spatial_ESN(number_neurons = self.N, external_sparsity = self.external_sparsity,intern_sparsity = self.intern_sparsity, \
-            number_input = self.number_input,number_output = self.number_output,\
-            spectral_radius = self.spectral_radius,leak_rate = self.leak_rate,noise = self.noise,isCopy = True)
-        buffer.N = self.N
-        buffer.W = np.copy(self.W)
-        buffer.W_in = np.copy(self.W_in)
-        buffer.W_out = np.copy(self.W_out)
-        buffer.connection_out = np.copy(self.connection_out)
-        buffer.W_back = np.copy(self.W_back)
-        buffer.x = np.copy(self.x)
-        buffer.y = np.copy(self.y)
-        buffer.n_iter = self.n_iter
-        print("---Copying done---")
+        with self.instrumentation.phase("copy"):
+            buffer = Spatial_ESN(number_neurons = self.N, external_sparsity = self.external_sparsity,intern_sparsity = self.intern_sparsity, \
+                number_input = self.number_input,number_output = self.number_output,\
+                spectral_radius = self.spectral_radius,leak_rate = self.leak_rate,noise = self.noise,isCopy = True,instrumentation = self.instrumentation,\
+                seed = self.seed,weight_format = self.weight_format,nb_workers = self.nb_workers,topology = self.topology,dtype = self.dtype.name,\
+                feedback = self.feedback)
+            buffer.rng.bit_generator.state = self.rng.bit_generator.state      #The copy draws the same noise.
+            buffer.N = self.N
+            buffer.W = self.W.copy()      #Dense or sparse.
+            buffer.set_input_weights(self.W_in,self.W_back)
+            buffer.W_out = np.copy(self.W_out)
+            buffer.connection_out = np.copy(self.connection_out)
+            buffer.x = np.copy(self.x)
+            buffer.y = np.copy(self.y)
+            buffer.n_iter = self.n_iter
+            buffer.istrained = self.istrained
+            if self.compact_readout is not None:
+                buffer.compact_readout = (np.copy(self.compact_readout[0]),np.copy(self.compact_readout[1]))
         return buffer
 
+    def get_output_neurons(self):
+        '''
+        Returns a boolean array of shape (N,), True for the neurons connected to the outputs.
+        '''
+        return self.connection_out.astype(bool)
+
+    def get_contributing_neurons(self, keepUndriven = False):
+        '''
+        Computes the neurons that can have an influence on the readout.
+        A neuron contributes if it has a path to a neuron connected to the output, and if it can be reached from a neuron connected to the input
+        (or the bias, or the output if the feedback is on).
+        The others are updated at every step for nothing: either their activity never reaches the output, or it is only the decaying trace of their initial state.
+        :parameters:
+            -keepUndriven, optional: Boolean, False by default. If True, neurons that are not reached from the input are kept as long as they reach the output, so that the pruning is exact even before the warmup.
+        :output:
+            A boolean array of shape (N,), True for the contributing neurons.
+        '''
+        to_output = get_reachable(self.W.T, self.get_output_neurons())    #Reachability in the reversed graph.
+        if keepUndriven:
+            return to_output
+        from_input = get_reachable(self.W, (self.get_input_weights() != 0).any(axis = 1))
+        return from_input * to_output
+
+    def prune(self, keepUndriven = False):
+        '''
+        Returns an independent copy of the ESN containing only the neurons that contribute to the readout (see get_contributing_neurons).
+        The predictions of the copy are the same as the ones of the whole network, once the initial state of the dropped neurons has been forgotten (ie after the warmup).
+        :parameters:
+            -keepUndriven, optional: Boolean, False by default. See get_contributing_neurons.
+        :output:
+            A tuple (pruned ESN, indices of the kept neurons in the original network).
+        '''
+        kept = np.flatnonzero(self.get_contributing_neurons(keepUndriven = keepUndriven))
+        buffer = self.copy()
+        buffer.N = len(kept)
+        buffer.W = self.W[kept][:,kept]
+        buffer.set_input_weights(self.W_in[kept],self.W_back[kept])
+        buffer.W_out = self.W_out[:,kept]
+        buffer.connection_out = self.connection_out[kept]
+        buffer.x = self.x[kept]
+        if self.compact_readout is not None:    #The selected neurons always reach the output, so they are kept.
+            buffer.compact_readout = (np.searchsorted(kept,self.compact_readout[0]),np.copy(self.compact_readout[1]))
+        buffer.len_warmup = self.len_warmup
+        buffer.len_training = self.len_training
+        self.instrumentation.message("Pruning: {} neurons kept out of {}, {:.1f}% of the reservoir saved",buffer.N,self.N,100 * (1 - buffer.N / self.N))
+        return buffer, kept
+
     def get_nearest_index(self,x,y):
         '''
         Given a position in the plane, returns the index of the nearest neuron
@@ -549,28 +1212,177 @@ class Spatial_ESN:
 #----------------------------------------------------------------------------------------------------------------------
 #Treatment functions. Used for display and to obtain results
 def compute_error(result,expected):
-    "Computes a least squared error between two arrays."
-    gap = 0
-    for i in range(len(result)):
-        gap += np.linalg.norm(result[i]-expected[i])
-    return gap
-
-def plot_distance(result,expected,beginning_len,title = "Comparison of efficiency"):
-    duration = len(result)
+    "Computes the sum of the distances between two series (see Evaluation.total_error)."
+    return float(Evaluation.total_error(result,expected)[0])
+
+def plot_distance(result,expected,beginning_len,title = "Comparison of efficiency",labels = None):
+    '''
+    Plots the normalized error of one or several runs at each step (see Evaluation.error_curves).
+    :parameters:
+        - result, expected: the predictions and the expected values, of shape (horizon, outputs) for a single run, or (runs, horizon, outputs).
+        - beginning_len: the step of the first prediction, or the one of each run if they differ (after an adaptive warmup for example).
+        - labels: optional, the legend of each run.
+    '''
+    curves = Evaluation.error_curves(result,expected)
+    x = np.reshape(np.broadcast_to(beginning_len,(curves.shape[0],)),(-1,1)) + np.arange(curves.shape[1])
     fig,axes = plt.subplots(nrows = 2, ncols = 1, sharex = True)
-    x = [i for i in range(beginning_len,beginning_len + duration)]
-    y = np.abs(np.array(result) - np.array(expected)[beginning_len:beginning_len +duration,])
-    axes[0].plot(x, y)
-    axes[1].plot(x, y)
+    axes[0].plot(x.T, curves.T)
+    axes[1].plot(x.T, curves.T)
     axes[1].set_title("Zoomed in version")
     axes[0].set_title(title)
     axes[1].set_ylim([0,1])
+    if labels is not None:
+        axes[0].legend(labels)
     plt.xlabel("Epochs")
-    fig.text(0.06, 0.5, 'Distance between expected and real signal', ha='center', va='center', rotation='vertical')
+    fig.text(0.06, 0.5, 'Normalized distance between expected and real signal', ha='center', va='center', rotation='vertical')
 
     plt.show()
 
-def compare_prediction(esn,input,label_input ,len_warmup,len_training, delays = [0],nb_iter = -1, display_anim = True,display_connectivity = True,bin_size = 0.1, savename = ""):
+def hops_to_delay(hops, leak_rate):
+    '''
+    Converts a number of hops in the reservoir into a mean delay, in steps.
+    Each hop costs one step, and each neuron crossed behaves as a low-pass filter whose mean lag is (1-leak_rate)/leak_rate steps.
+    '''
+    return np.asarray(hops) + (np.asarray(hops) + 1) * (1 - leak_rate) / leak_rate
+
+def estimate_delay_from_graph(esn, max_hops = 200):
+    '''
+    Estimates how long the input takes to reach the neurons connected to the output, using only the connectivity.
+    :parameters:
+        - esn : an instance of Spatial_ESN
+        - max_hops: optional, the longest path considered (only matters for reservoirs with cycles).
+    :output:
+        A dictionary containing:
+        - "hops": the shortest number of hops from an input neuron, for each output neuron reachable from the input.
+        - "shortest": the delay (in steps) of the shortest path, scaled by the leak rate.
+        - "distribution": an array p such that p[k] is the share of the input signal energy reaching the output after k hops.
+          The energy is propagated with the squared weights, as the signs of the weights are random,
+          and each neuron crossed keeps leak_rate/(2-leak_rate) of the energy of an impulse (leaky integration).
+        - "delays": the delay (in steps) associated to each entry of "distribution".
+        - "mean": the mean delay (in steps) of this distribution.
+    '''
+    sources = (esn.W_in[:,1:] != 0).any(axis = 1)       #The bias doesn't carry any signal.
+    outputs = esn.get_output_neurons()
+    graph = sparse.csr_matrix(esn.W != 0).T             #graph[j,i] means an edge from j to i.
+    hops = csgraph.dijkstra(graph, directed = True, indices = np.flatnonzero(sources), unweighted = True, min_only = True)
+    hops = hops[outputs]
+    hops = hops[np.isfinite(hops)]
+
+    #Propagation of the energy, hop by hop. The scale is kept apart to avoid overflows.
+    gain_matrix = sparse.csr_matrix(esn.W)
+    gain_matrix.data **= 2
+    gain_matrix *= esn.leak_rate / (2 - esn.leak_rate)
+    gain = np.sum(esn.W_in[:,1:]**2, axis = 1)
+    log_received = []
+    log_scale = 0
+    for _ in range(max_hops):
+        received = np.sum(gain[outputs])
+        log_received.append(np.log(received) + log_scale if received > 0 else -np.inf)
+        gain = gain_matrix @ gain
+        maximum = np.max(gain)
+        if maximum == 0:    #No path is longer than this (always the case for the spatial reservoir, which is acyclic).
+            break
+        gain /= maximum
+        log_scale += np.log(maximum)
+    log_received = np.array(log_received)
+    if np.all(np.isinf(log_received)):
+        raise Exception("The input can't reach any neuron connected to the output")
+    distribution = np.exp(log_received - np.max(log_received))
+    distribution /= np.sum(distribution)
+    delays = hops_to_delay(np.arange(len(distribution)), esn.leak_rate)
+
+    return {"hops" : hops,
+            "shortest" : float(hops_to_delay(np.min(hops), esn.leak_rate)),
+            "distribution" : distribution,
+            "delays" : delays,
+            "mean" : float(np.sum(distribution * delays))}
+
+def estimate_delay_from_impulse(esn, len_impulse = 100, amplitude = 0.1):
+    '''
+    Estimates how long the input takes to reach the readout, by sending an impulse through the reservoir from its current state.
+    Two copies of the state are run side by side (with and without the impulse), so the network itself is left untouched.
+    :parameters:
+        - esn : an instance of Spatial_ESN
+        - len_impulse: optional, for how many steps the response is observed.
+        - amplitude: optional, the amplitude of the impulse. Should be small, so that the response stays close to linear.
+    :output:
+        A dictionary containing:
+        - "response": an array of size len_impulse, the share of the response seen by the output neurons at each step.
+        - "peak": the step where the response is maximal.
+        - "mean": the mean delay (in steps) of the response.
+    '''
+    outputs = esn.get_output_neurons()
+    states = np.tile(esn.x["activity"][np.newaxis].T, (1,2))
+    inputs = np.zeros((esn.number_input,2))
+    response = np.zeros((len_impulse))
+    for step in range(len_impulse):
+        inputs[:,1] = amplitude if step == 0 else 0
+        states = esn.step_states(states, inputs)
+        response[step] = np.sum(np.abs(states[outputs,1] - states[outputs,0]))
+    if np.sum(response) == 0:
+        raise Exception("The input can't reach any neuron connected to the output")
+    response /= np.sum(response)
+    return {"response" : response,
+            "peak" : int(np.argmax(response)),
+            "mean" : float(np.sum(response * np.arange(len_impulse)))}
+
+def get_candidate_delays(esn, nb_candidates = 5, method = "graph", max_delay = None):
+    '''
+    Proposes a few training delays, spread over the estimated delay distribution of the reservoir, instead of trying every possible delay.
+    The state reached after the input of step t-1 is used to predict the expected value of step t - delay (see compare_prediction),
+    so a propagation delay of D steps corresponds to a training delay of D + 1.
+    :parameters:
+        - esn : an instance of Spatial_ESN
+        - nb_candidates: optional, the maximum number of delays returned.
+        - method: optional, "graph" (see estimate_delay_from_graph) or "impulse" (see estimate_delay_from_impulse).
+        - max_delay: optional, the delays are clipped to this value (typically len_warmup).
+    :output:
+        A sorted list of integer delays.
+    '''
+    if method == "graph":
+        estimation = estimate_delay_from_graph(esn)
+        delays, distribution = estimation["delays"], estimation["distribution"]
+    elif method == "impulse":
+        distribution = estimate_delay_from_impulse(esn)["response"]
+        delays = np.arange(len(distribution))
+    else:
+        raise Exception("Unknown delay estimation method: {}".format(method))
+    quantiles = (np.arange(nb_candidates) + 0.5) / nb_candidates
+    cumulated = np.cumsum(distribution)
+    candidates = np.round(delays[np.minimum(np.searchsorted(cumulated, quantiles), len(delays) - 1)]).astype(int) + 1
+    if max_delay is not None:
+        candidates = np.minimum(candidates, max_delay)
+    return sorted(set(candidates.tolist()))
+
+def compare_online_training(esn, input, len_warmup, len_training, nb_iter = 200, update_every = [1,10]):
+    '''
+    Compares the batch training with the online (recursive least squares) one: throughput of the training, and error of the simulation that follows.
+    Each training is done on a copy of the given esn, after the same warmup.
+    :output:
+        A dictionary associating to each mode ("batch", "online_1", ...) its number of training steps per second and its error.
+    '''
+    esn.warmup(input[:len_warmup])
+    inputs = input[len_warmup:len_warmup + len_training]
+    expected = input[len_warmup + len_training:len_warmup + len_training + nb_iter]
+    results = {}
+    for mode in ["batch"] + ["online_{}".format(k) for k in update_every]:
+        copy = esn.copy()
+        begin = time.perf_counter()
+        if mode == "batch":
+            copy.train(inputs,inputs)
+        else:
+            copy.begin_online_training(update_every = int(mode.split("_")[1]))
+            copy.train_online(inputs,inputs)
+            copy.end_online_training()
+        duration = time.perf_counter() - begin
+        error = compute_error(copy.simulation(nb_iter = nb_iter),expected)
+        results[mode] = {"steps_per_second" : len_training / duration, "error" : error}
+    for mode,result in results.items():
+        esn.instrumentation.message("{:10s}: {:10.0f} training steps/s ---- Error : {}",mode,result["steps_per_second"],result["error"])
+    return results
+
+def compare_prediction(esn,input,label_input ,len_warmup,len_training, delays = [0],nb_iter = -1, display_anim = True,display_connectivity = True,bin_size = 0.1, savename = "", warmup_tolerance = None,
+                       recorder = "full", chunk_size = None):
     '''
     Trains the network, and display both the expected result and the network output. Can also save/display the plot of the inner working.
     :parameters:
@@ -579,29 +1391,50 @@ def compare_prediction(esn,input,label_input ,len_warmup,len_training, delays =
         - label_input : the name for the plot
         - len_warmup: For how long the ESN is warmupped
         - len_training : the length of the training
+        - delays : the training delays compared. "auto" only tries a few delays estimated from the structure of the reservoir (see get_candidate_delays)
         - nb_iter : for how long the simulation is done after training. Computed by default to fit the length of input
         - displayAnim : Wether the internal state is plotted
         - savename: optionnal, where the .mp4 is generated. If not filled, it won't be generated.
+        - warmup_tolerance: optional, stops each warmup once the initial state is forgotten (see Spatial_ESN.warmup). len_warmup is then the maximum length of the warmup.
+        - recorder: optional, what is recorded (see Planner, which chooses it from the memory available):
+            "full" (default): the activity of every neuron at every step, for the animation and disp_connectivity.
+            "bins": only the mean activity of the vertical bins, left in esn.statistics (see Propagation_analysis.analyze_esn). No animation.
+            "none": nothing. No animation.
+        - chunk_size: optional, see Spatial_ESN.train.
+    :output:
+        The scores of each delay, see Evaluation.evaluate.
     '''
-
-    display = display_anim or (savename != "")
-    if display or display_connectivity: #We need to record the states for both display methods.
+    if recorder not in ["full","bins","none"]:
+        raise Exception("Unknown recorder: {}".format(recorder))
+    display = (display_anim or (savename != "")) and recorder == "full"
+    if (display_anim or (savename != "")) and not display:
+        esn.instrumentation.message("No animation with the recorder \"{}\"",recorder)
+    if recorder == "full" and (display or display_connectivity): #We need to record the states for both display methods.
         esn.begin_record()
+    if display or recorder == "bins":
+        esn.begin_statistics(bin_size = bin_size)   #The histogram of the animation reads the bin means from it.
     if nb_iter ==-1:
         nb_iter = len(input) - len_warmup - len_training
-    print("Nb_iter: ",nb_iter)
+    esn.instrumentation.message("Nb_iter: {}",nb_iter)
+    if delays == "auto":
+        delays = get_candidate_delays(esn, max_delay = len_warmup)
+        esn.instrumentation.message("Estimated training delays: {}",delays)
 
     simus = []      #To handle several copies of a simulation. Used to compare the efficiency of delay.
+    warmups = []    #The actual length of each warmup, which may differ if warmup_tolerance is given.
     for i in range(len(delays)-1):
-        expected = input[len_warmup + delays[i]:len_warmup + delays[i] + len_training] #The awaited results during the training. delays allow to offset the expected result, due to delay to cross the reservoir.
+        #The awaited results during the training are taken from the input (see Spatial_ESN.simulation). delays allow to offset the expected result, due to delay to cross the reservoir.
         copy = esn.copy()
-        simus.append(copy.simulation(nb_iter = nb_iter, inputs = input, expected = expected, len_warmup = len_warmup, len_training = len_training, reset = False ))
-
+        simus.append(copy.simulation(nb_iter = nb_iter, inputs = input, len_warmup = len_warmup, len_training = len_training, delay = delays[i], reset = False,
+                                     warmup_tolerance = warmup_tolerance, chunk_size = chunk_size))
+        warmups.append(copy.len_warmup)
 
-    expected = input[len_warmup - delays[-1]:len_warmup - delays[-1] + len_training] #The awaited results during the training.
-    simus.append(esn.simulation(nb_iter = nb_iter, inputs = input, expected = expected, len_warmup = len_warmup, len_training = len_training, reset = False))
+    simus.append(esn.simulation(nb_iter = nb_iter, inputs = input, len_warmup = len_warmup, len_training = len_training, delay = delays[-1], reset = False,
+                                warmup_tolerance = warmup_tolerance, chunk_size = chunk_size))
+    warmups.append(esn.len_warmup)
     if display:
         esn.end_record(savename, bin_len = bin_size, isDisplayed = display_anim)
+        esn.end_statistics()
     if display_connectivity:
         esn.disp_connectivity()
 
@@ -615,95 +1448,91 @@ def compare_prediction(esn,input,label_input ,len_warmup,len_training, delays =
     elif nb_cols == 1:
         axes = list(map(lambda x : [x],axes))
 
-    min_error = np.inf
-    optimal_delay = -1
-    i,j = 0,0
-    while nb_cols*(i) + j+1 <= len(delays):
-        x = range(len_warmup+len_training,nb_iter+len_warmup+len_training)
-        expected = input[len_warmup + len_training - delays[nb_cols*i + j] : nb_iter + len_warmup + len_training - delays[nb_cols*i + j]]
-        axes[i][j].plot(x, expected ,'--',label = label_input)
-        axes[i][j].plot(x, simus[nb_cols*i + j],'-', label = "ESN response")
-        axes[i][j].set_title("Delay: {} steps".format(delays[nb_cols*i + j]))
-
-        error = compute_error(simus[nb_cols*i + j],expected)
-        if error < min_error:
-            min_error = error
-            optimal_delay = delays[nb_cols*i + j]
-        print("Training delay: {} ---- Error : {}".format(delays[nb_cols*i + j],error))
-        if j == nb_cols - 1:
-            j=0
-            i+=1
-        else:
-            j+=1
+    #The expected result of each delay, all scored at once.
+    beginnings = np.array(warmups) + len_training
+    expected = Evaluation.get_windows(input, beginnings - np.array(delays), nb_iter)
+    scores = Evaluation.evaluate(simus, expected)
+    for index in range(len(delays)):
+        i, j = divmod(index, nb_cols)
+        x = range(beginnings[index],nb_iter+beginnings[index])
+        axes[i][j].plot(x, expected[index] ,'--',label = label_input)
+        axes[i][j].plot(x, simus[index],'-', label = "ESN response")
+        axes[i][j].set_title("Delay: {} steps".format(delays[index]))
+        esn.instrumentation.message("Training delay: {} ---- Error : {} ---- NRMSE : {:.4f} ---- Valid prediction time : {} steps",
+                                    delays[index],scores["error"][index],scores["nrmse"][index],scores["valid_time"][index])
         #axes[i][j].legend()
     fig.suptitle("ESN with {} neurons\n external sparsity: {}\n internal sparsity {}".format(esn.N,esn.external_sparsity,esn.intern_sparsity))
     #fig.tight_layout(pad=3.0)
     if len(delays) <=4:
         plt.legend()
-    print("The optimal delay for those parameters is {},with an error of {}".format(optimal_delay,min_error))
+    best = scores["ranking"][0]
+    esn.instrumentation.message("The optimal delay for those parameters is {},with an error of {} (NRMSE {:.4f})",delays[best],scores["error"][best],scores["nrmse"][best])
     plt.show()
     plt.close()
-    plot_distance(expected = input, result = simus[0],beginning_len = len_warmup + len_training)
+    plot_distance(expected = expected, result = simus, beginning_len = beginnings, labels = ["Delay: {}".format(delay) for delay in delays])
+    return scores
 
-def generate_basic_ESN(number_neurons, sparsity, number_input, number_output, spectral_radius, leak_rate, noise):
+def generate_basic_ESN(number_neurons, sparsity, number_input, number_output, spectral_radius, leak_rate, noise, seed = None, weight_format = "dense", dtype = "float64"):
     '''
     Creates a basic ESN, but using the spatial ESN. The idea is to be able to compare the results.
+    It is built directly with a random topology (see Spatial_ESN.build_random), sparsity being the probability of each connection.
+    seed, weight_format and dtype: see Spatial_ESN.
     '''
-    buffer = Spatial_ESN(number_neurons = number_neurons, external_sparsity = 1,intern_sparsity = sparsity, number_input = number_input, \
-                    number_output = number_output, spectral_radius = spectral_radius, leak_rate = leak_rate, noise = noise)
-
-    #We must regenerate the W matrix, since it is generated with space contraints otherwise.
-    buffer.N = number_neurons
-    buffer.W = np.random.uniform(-1,1,(number_neurons,number_neurons))
-    intern_connections = (np.random.uniform(0,1,buffer.W.shape) < sparsity)
-    buffer.W *= intern_connections
-
-    current_radius = np.max(np.abs(np.linalg.eigvals(buffer.W)))
-    if current_radius == 0.0:
-        raise Exception("Null Spectral radius for generated matrix")
-    else:
-        buffer.W *= spectral_radius/current_radius            #We normalize the weight matrix to get the desired spectral radius.
-    buffer.W_in = 0.5 * np.random.uniform(-1,1,(number_neurons, 1 + number_input))    #We initialise between -1 and 1 uniformly, maybe to change
-    buffer.W_out = 0.5 * np.random.uniform(-1,1,(number_output, number_neurons))
-    buffer.connection_out = np.ones(buffer.W_out.shape)
-    buffer.x = np.zeros((number_neurons),dtype = [("activity",float),("position",float,(2,)),("mean",float)])
-    buffer.x["activity"] = np.random.uniform(-1,1,(number_neurons,))   #Internal state of the reservoir. Initialisation might change
+    return Spatial_ESN(number_neurons = number_neurons, external_sparsity = 1,intern_sparsity = sparsity, number_input = number_input, \
+                    number_output = number_output, spectral_radius = spectral_radius, leak_rate = leak_rate, noise = noise, seed = seed, \
+                    weight_format = weight_format, topology = "random", dtype = dtype)
 
-    buffer.x["mean"] = np.copy(buffer.x["activity"])
-    return buffer
+def get_backward_connections(esn):
+    '''
+    Finds the connections of W that don't go forward along x (W[i,j] != 0 with x_i <= x_j). There are none in a spatial reservoir.
+    Only the nonzeros of W are looked at.
+    :output:
+        A tuple of arrays (targets, sources), the indices i and j of each backward connection.
+    '''
+    targets, sources = sparse.coo_matrix(esn.W).nonzero()
+    posx = esn.x["position"][:,0]
+    backward = posx[targets] <= posx[sources]
+    return targets[backward], sources[backward]
 
-def disp_sorted_matrix(esn):
+def disp_sorted_matrix(esn, resolution = 500, nb_reported = 10):
     '''
-    Takes an esn and displays its W matrix sorted by ascending x.
+    Takes an esn and displays its W matrix, lines and columns sorted by ascending x: a spatial reservoir is then lower triangular.
+    The backward connections (see get_backward_connections) are reported.
+    Large matrixes are shown downsampled: each pixel is the density of connections of a block of the sorted matrix.
+    :parameters:
+        - resolution: optional, the maximum number of pixels along each side of the image.
+        - nb_reported: optional, the number of backward connections detailed.
+    :output:
+        The backward connections, see get_backward_connections.
     '''
-    W = np.copy(esn.W)
     posx = esn.x["position"][:,0]
-    matrix = np.zeros((esn.N),dtype = [("x",float),("connection",float,(esn.N,))])
-    print(matrix[:]["x"].shape,posx.shape)
-    for neuron in range (esn.N):
-        matrix[neuron]["x"] = posx[neuron]
-        matrix[neuron]["connection"] = W[neuron]    #Connection will describe the previous neurons, connected to this one
-
-    matrix.sort(axis = 0,order = "x")
-    for neuron in range(esn.N):
-        W[neuron] = np.copy(matrix[neuron]["connection"])
-
-    for neuron1 in range(esn.N):
-        for neuron2 in range(neuron1+1,esn.N):
-            if matrix[neuron1]["x"]>matrix[neuron2]["x"]:
-                print("Backward connexion",neuron1,";",neuron2,";",posx[neuron1],";", posx[neuron2])
-    is_connected = (W != 0)
-    deltax = np.tile(matrix["x"],(esn.N,1))
-    deltax = (deltax.T - deltax)
-    print("Test display",np.sum((deltax.T * is_connected) <0))
-    ind = np.unravel_index(np.argmin(deltax*is_connected, axis=None), deltax.shape) #Gets the index of the minimum of the distances array
-    if (deltax*is_connected)[ind] <0:
-        print("Negative distance connections, index {}, deltax = {}".format(ind,deltax[ind]))
+    targets, sources = get_backward_connections(esn)
+    esn.instrumentation.message("{} backward connections",len(targets))
+    for target, source in zip(targets[:nb_reported], sources[:nb_reported]):
+        esn.instrumentation.message("Backward connexion {} ; {} ; {} ; {}",source,target,posx[source],posx[target])
+
+    W = sparse.coo_matrix(esn.W)
+    W.eliminate_zeros()
+    rank = np.empty((esn.N),dtype = int)
+    rank[np.argsort(posx, kind = "stable")] = np.arange(esn.N)       #The position of each neuron once sorted.
+    nb_blocks = min(resolution, esn.N)
+    block_rows = rank[W.row] * nb_blocks // esn.N
+    block_cols = rank[W.col] * nb_blocks // esn.N
+    blocks = block_rows * nb_blocks + block_cols
+
     fig = plt.figure()
     ax = plt.subplot(1,1,1, aspect=1, frameon=False)
-    image = ax.imshow(W,cmap = cm.coolwarm ,vmin = np.min(W), vmax = np.max(W))
-    fig.suptitle("Matrix of size {}x{}\n{} effective connections\nLines of W are sorted according to ascending x".format(esn.N,esn.N,np.sum(is_connected)))
+    if nb_blocks == esn.N:     #One pixel per weight.
+        image = np.bincount(blocks, weights = W.data, minlength = nb_blocks**2).reshape(nb_blocks,nb_blocks)
+        ax.imshow(image,cmap = cm.coolwarm ,vmin = np.min(image), vmax = np.max(image))
+    else:
+        block_size = esn.N / nb_blocks
+        image = np.bincount(blocks, minlength = nb_blocks**2).reshape(nb_blocks,nb_blocks) / block_size**2
+        pixels = ax.imshow(image,cmap = cm.viridis, extent = [0,esn.N,esn.N,0])
+        fig.colorbar(pixels, ax = ax, label = "Density of connections")
+    fig.suptitle("Matrix of size {}x{}\n{} effective connections\nLines and columns of W are sorted according to ascending x".format(esn.N,esn.N,W.nnz))
     plt.show()
+    return targets, sources
 #----------------------------------------------------------------------------------------------------------------------
 #File and json handling
 
@@ -761,30 +1590,32 @@ if __name__  == "__main__":
     np.random.seed(seed)
 
     #Training and samplig dataset import.
-    if label_input == "Mackey Glass":
-        input = np.load("mackey-glass.npy")[np.newaxis].T
-    elif label_input == "Sinus":
-        t = np.arange(start = 0,stop = 1000,step = 1/10)
-        input = np.sin(t) + 0.1 * np.cos(10*t)
-    elif label_input == "Constant":
-        input = 10 * np.ones((1000000))
+    input = Datasets.load_series(label_input,len_input)
+    #Choosing how to run it in the memory available (fails right away if it can't).
+    display = display_animation or savename != "" or display_connectivity
+    plan = Planner.plan(number_neurons, len_warmup, len_training, simulation_len, intern_sparsity = intern_sparsity, external_sparsity = external_sparsity,
+                        nb_delays = 5 if delays == "auto" else len(delays), bin_size = bin_size, recorder = recorder if display else "none",
+                        weight_format = weight_format, dtype = dtype, memory_budget = memory_budget, instrumentation = default_instrumentation)
     #Creating the ESN
     spatial_esn = Spatial_ESN(number_neurons = number_neurons, external_sparsity = external_sparsity,\
                       intern_sparsity = intern_sparsity, number_input = 1, number_output = 1,\
-                      spectral_radius = spectral_radius, leak_rate = leak_rate, noise = noise)
+                      spectral_radius = spectral_radius, leak_rate = leak_rate, noise = noise,\
+                      seed = seed, weight_format = plan["weight_format"], nb_workers = nb_workers, dtype = plan["dtype"], feedback = feedback)
     regular_esn = generate_basic_ESN(number_neurons = number_neurons,\
                       sparsity = intern_sparsity, number_input = 1, number_output = 1,\
-                      spectral_radius = spectral_radius, leak_rate = leak_rate, noise = noise)
+                      spectral_radius = spectral_radius, leak_rate = leak_rate, noise = noise, seed = seed + 1,\
+                      weight_format = plan["weight_format"], dtype = plan["dtype"])
 
-    spatial_esn.W_back *= 0
     spatial_esn.x["activity"]*=0
     #test.W_in = (test.W_in != 0)
     #test.W = (test.W != 0)
-    print("Effective spectral radius :",max(abs(np.linalg.eig(spatial_esn.W)[0]))) #Check wether the spectral radius is respected.
+    if plan["weight_format"] == "dense":
+        print("Effective spectral radius :",max(abs(np.linalg.eig(spatial_esn.W)[0]))) #Check wether the spectral radius is respected.
     disp_sorted_matrix(spatial_esn)
 
     compare_prediction(spatial_esn,input = input,len_warmup = len_warmup, len_training = len_training, delays = delays, nb_iter = simulation_len,display_anim = display_animation,\
-        display_connectivity = display_connectivity ,bin_size = bin_size,savename = savename,label_input = label_input + " series")
+        display_connectivity = display_connectivity ,bin_size = bin_size,savename = savename,label_input = label_input + " series", warmup_tolerance = warmup_tolerance,\
+        recorder = plan["recorder"], chunk_size = plan["chunk_size"])
     '''
     compare_prediction(regular_esn,input = input,len_warmup = len_warmup, len_training = len_training, delays = delays, nb_iter = simulation_len,display_anim = False,\
     display_connectivity = False ,bin_size = bin_size,savename = "",label_input = label_input + " series")
@@ -0,0 +1,221 @@
+'''
+Streaming of a trained Spatial ESN: the samples come from an async iterator (a sensor, a socket...), and the predictions are yielded as they are computed.
+
+    stream = Streaming.Stream(esn, mode = "teacher")
+    async for result in stream.run(source):
+        ...                                     #result["prediction"] is the prediction of the next sample.
+    stream.set_mode("closed_loop")              #Can be called at any time, for example from another task.
+
+The samples are read by a producer task into a bounded queue. The ESN consumes them by micro-batches: every sample already waiting is
+processed in one go (up to max_batch), in a worker thread so that the event loop keeps receiving samples meanwhile.
+The latency of each sample (from its arrival to its prediction) is kept, see get_latency_percentiles.
+
+Usage:
+    python Streaming.py [--rate 2000] [--length 3000]
+runs a trained ESN against a simulated Mackey-Glass source, and reports the latency percentiles.
+'''
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+MODES = ["teacher", "closed_loop"]
+
+# Default parameters
+_data = {
+    "seed" : 21,
+    "number_neurons" : 400,
+    "len_warmup" : 100,
+    "len_training" : 1000,
+    "rate" : 2000,              #Samples per second of the simulated source.
+    "length" : 3000,            #Number of samples streamed.
+    "max_batch" : 64,           #Maximum number of samples processed in one micro-batch.
+    "max_pending" : 1024,       #Maximum number of samples waiting in the queue.
+    "percentiles" : [50, 90, 99, 100],
+}
+
+_end = object()     #Put in the queue once the source is exhausted.
+
+#----------------------------------------------------------------------------------------------------------------------
+
+class Stream:
+    '''
+    Runs a Spatial ESN on a stream of samples.
+    In "teacher" mode, each sample is given as input, and as target: an online training learns from it (see Spatial_ESN.begin_online_training),
+    and an ESN with output feedback is fed back the sample itself instead of its output (the teacher signal of a training with delay 0).
+    In "closed_loop" mode, the ESN is fed its own output, and each sample only triggers one step (it is kept to measure the error).
+    The latency is bounded: at most max_pending samples wait in the queue, and at most max_batch are processed before the predictions are yielded.
+    '''
+    def __init__(self, esn, mode = "teacher", max_batch = _data["max_batch"], max_pending = _data["max_pending"], overflow = "wait", threaded = True):
+        '''
+        :parameters:
+            - esn: a trained instance of Spatial_ESN.
+            - mode: optional, "teacher" or "closed_loop".
+            - max_batch: optional, the maximum number of samples processed in one micro-batch.
+            - max_pending: optional, the maximum number of samples waiting to be processed.
+            - overflow: optional, what happens when max_pending samples are already waiting. "wait" slows the source down (backpressure),
+              "drop" drops the oldest waiting sample (for sources that can't wait, like a live sensor). The dropped samples are counted in self.dropped.
+            - threaded: optional, True by default. Wether the micro-batches are processed in a worker thread, so that the event loop isn't blocked.
+        '''
+        if overflow not in ["wait", "drop"]:
+            raise Exception("Unknown overflow policy: {}".format(overflow))
+        self.esn = esn
+        self.set_mode(mode)
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.threaded = threaded
+        self.latencies = []
+        self.batch_sizes = []
+        self.dropped = 0
+
+    def set_mode(self, mode):
+        '''
+        Switches between "teacher" and "closed_loop". Takes effect from the next micro-batch.
+        '''
+        if mode not in MODES:
+            raise Exception("Unknown streaming mode: {}".format(mode))
+        self.mode = mode
+
+    def process(self, samples, mode):
+        '''
+        Advances the ESN by one step per sample, and returns the predictions (the output after each step), array of shape (len(samples), number_output).
+        '''
+        esn = self.esn
+        predictions = np.zeros((len(samples), esn.number_output))
+        for i, sample in enumerate(samples):
+            if mode == "teacher":
+                esn.update(np.reshape(sample,(-1,)), target = sample)      #Fed back with the feedback, and learnt by an online training.
+            else:
+                esn.update(esn.y)
+            predictions[i] = np.reshape(esn.y,(-1,))
+        return predictions
+
+    async def _produce(self, source, queue):
+        try:
+            async for sample in source:
+                item = (sample, time.perf_counter())
+                if self.overflow == "drop" and queue.full():
+                    queue.get_nowait()
+                    self.dropped += 1
+                    queue.put_nowait(item)
+                else:
+                    await queue.put(item)
+        except Exception:
+            await queue.put(_end)       #The consumer stops, and run raises the exception.
+            raise
+        await queue.put(_end)
+
+    async def run(self, source):
+        '''
+        Consumes the samples of source, and yields a dictionary per sample, with:
+            - "index": the number of the sample (dropped samples are not numbered).
+            - "input": the sample.
+            - "prediction": the output of the ESN after this sample, ie its prediction of the next sample.
+            - "mode": the mode used for this sample.
+            - "latency": the time between the arrival of the sample and its prediction, in seconds.
+        '''
+        queue = asyncio.Queue(maxsize = self.max_pending)
+        producer = asyncio.ensure_future(self._produce(source, queue))
+        index = 0
+        finished = False
+        try:
+            while not finished:
+                batch = [await queue.get()]
+                while len(batch) < self.max_batch and not queue.empty():
+                    batch.append(queue.get_nowait())
+                if batch[-1] is _end:   #The end marker is always the last item of the queue.
+                    batch.pop()
+                    finished = True
+                if len(batch) == 0:
+                    continue
+                samples = [sample for sample,_ in batch]
+                mode = self.mode
+                if self.threaded:
+                    predictions = await asyncio.to_thread(self.process, samples, mode)
+                else:
+                    predictions = self.process(samples, mode)
+                now = time.perf_counter()
+                self.batch_sizes.append(len(batch))
+                for (sample, arrival), prediction in zip(batch, predictions):
+                    self.latencies.append(now - arrival)
+                    yield {"index" : index, "input" : sample, "prediction" : prediction, "mode" : mode, "latency" : now - arrival}
+                    index += 1
+        finally:
+            producer.cancel()
+        await producer      #Raises the exception of the source, if any.
+
+    def get_latency_percentiles(self, percentiles = _data["percentiles"]):
+        '''
+        Returns a dictionary associating each percentile to the corresponding latency (in seconds) over the samples streamed so far.
+        '''
+        if len(self.latencies) == 0:
+            return {}
+        return dict(zip(percentiles, np.percentile(self.latencies, percentiles)))
+
+def simulated_source(series, rate = _data["rate"]):
+    '''
+    An async iterator yielding the values of series at a regular rate (samples per second), like a sensor would.
+    The timing is absolute, so the average rate is kept even when the event loop wakes up late.
+    '''
+    async def source():
+        begin = time.perf_counter()
+        for i, sample in enumerate(series):
+            delay = begin + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield sample
+    return source()
+
+async def stream_series(stream, series, rate = _data["rate"], switch = None):
+    '''
+    Streams series through stream from a simulated source, and reports the latency.
+    :parameters:
+        - stream: a Stream.
+        - series: the samples streamed.
+        - rate: optional, see simulated_source.
+        - switch: optional, the index of the sample from which the stream switches to closed-loop mode.
+    :output:
+        A tuple (predictions, latency percentiles), predictions being an array of shape (len(series) - dropped samples, number_output).
+    '''
+    predictions = []
+    async for result in stream.run(simulated_source(series, rate)):
+        predictions.append(result["prediction"])
+        if switch is not None and result["index"] + 1 == switch:
+            stream.set_mode("closed_loop")
+    percentiles = stream.get_latency_percentiles()
+    stream.esn.instrumentation.message("Streamed {} samples, {} dropped, mean micro-batch of {:.1f} samples",
+                                       len(predictions), stream.dropped, np.mean(stream.batch_sizes) if stream.batch_sizes else 0)
+    for percentile, latency in percentiles.items():
+        stream.esn.instrumentation.message("    latency p{}: {:.3f} ms", percentile, 1000 * latency)
+    return np.array(predictions), percentiles
+
+#----------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    import Datasets
+    import Evaluation
+    import Spatial_ESN
+
+    parser = argparse.ArgumentParser(description = "Streams a series through a trained Spatial ESN, and reports the latency.")
+    parser.add_argument("--rate", type = float, default = _data["rate"], help = "samples per second of the simulated source")
+    parser.add_argument("--length", type = int, default = _data["length"], help = "number of samples streamed")
+    parser.add_argument("--switch", type = int, default = None, help = "index of the sample from which the ESN runs in closed loop")
+    arguments = parser.parse_args()
+
+    np.random.seed(_data["seed"])
+    len_warmup, len_training = _data["len_warmup"], _data["len_training"]
+    length = len_warmup + len_training + arguments.length
+    if length <= len(Datasets.load_series("Mackey Glass")):
+        input = Datasets.load_series("Mackey Glass", length)
+    else:       #Longer than the bundled series.
+        input = Datasets.load_series("Mackey Glass generated", length, normalize = True)
+    esn = Spatial_ESN.Spatial_ESN(number_neurons = _data["number_neurons"], external_sparsity = 0.3, intern_sparsity = 0.15, number_input = 1,
+                                  number_output = 1, spectral_radius = 1, leak_rate = 0.7, noise = 0.001)
+    esn.simulation(nb_iter = 0, inputs = input, len_warmup = len_warmup, len_training = len_training)
+
+    series = input[len_warmup + len_training:]
+    stream = Stream(esn)
+    predictions, _ = asyncio.run(stream_series(stream, series, rate = arguments.rate, switch = arguments.switch))
+    esn.instrumentation.message("One step ahead NRMSE: {:.4f}", Evaluation.nrmse(predictions[:-1], series[1:len(predictions)])[0])